@@ -0,0 +1,169 @@
+import numpy as np
+from typing import Callable, Hashable, Iterable
+from combinationlockcracker import CombinationLockCracker
+from models import Models
+from stats import Stats
+from topk import top_k_indices
+
+
+class BatchCombinationLockCracker:
+	"""
+	This class cracks many locks at once. It does the same thing as one
+	CombinationLockCracker per lock, except that the posteriors of all the
+	locks are kept as one 2-D array (locks x codes) and a whole batch of
+	observations for any of the locks is applied in one vectorized step.
+
+	All the locks must have the same number of digits and share the same
+	observation model, so each distinct observation of a batch has its
+	likelihood row computed once no matter how many locks observed it.
+	"""
+
+	def __init__(self, digit_count: int, observation_model: Callable, lock_ids: Iterable = None,
+				 stats: Stats = None) -> None:
+		"""
+		initialize the batch cracker
+
+		:param digit_count: the number of digits in the combinations
+		:param observation_model: see CombinationLockCracker.__init__
+		:param lock_ids: hashable ids of the locks to track
+		:param stats: see CombinationLockCracker.__init__
+		"""
+		self._digit_count: int = digit_count
+		self.obs_model = observation_model
+		self.stats: Stats = Stats(enabled=False) if stats is None else stats
+		self._lock_ids: list = [] if lock_ids is None else list(lock_ids)
+		self._lock_index: dict = {lock_id: row for row, lock_id in enumerate(self._lock_ids)}
+		assert len(self._lock_index) == len(self._lock_ids), 'lock ids must be distinct'
+		# one row per lock, in the order of _lock_ids. add_lock grows it
+		# geometrically, so the rows past the last lock are unused capacity
+		sample_space_size = 10 ** digit_count
+		self._posteriors: np.ndarray = np.full((len(self._lock_ids), sample_space_size), 1 / sample_space_size)
+
+	def add_lock(self, lock_id: Hashable) -> None:
+		"""
+		start tracking a new lock with a uniform distribution
+		"""
+		assert lock_id not in self._lock_index, 'lock %s is already tracked' % str(lock_id)
+		sample_space_size = 10 ** self._digit_count
+		row = len(self._lock_ids)
+		if row == len(self._posteriors):
+			posteriors = np.empty((max(2 * row, 1), sample_space_size))
+			posteriors[:row] = self._posteriors
+			self._posteriors = posteriors
+		self._posteriors[row] = 1 / sample_space_size
+		self._lock_index[lock_id] = row
+		self._lock_ids.append(lock_id)
+
+	def lock_ids(self) -> list:
+		"""
+		return the ids of the tracked locks
+		"""
+		return list(self._lock_ids)
+
+	def observe_batch(self, observations: Iterable, count: int = None) -> dict or None:
+		"""
+		based on a batch of (lock_id, observation) pairs, update our belief
+		about the code of each of those locks. A lock may appear many times in
+		the same batch. Invalid pairs are skipped and counted.
+
+		The update happens in log space: each lock receives the sum of the
+		log-likelihoods of its observations, computed as one product of the
+		(lock x observation) count matrix with the log-likelihood rows.
+
+		:param observations: an iterable of (lock_id, observation) pairs
+		:param count:
+			if given, return the @count most probable codes of every lock
+			updated by this batch (see top_k)
+		"""
+		failure_count = 0
+		rows, parsed = [], []
+		for lock_id, obs in observations:
+			try:
+				row = self._lock_index[lock_id]
+				obs = CombinationLockCracker.parse_observation(obs, self._digit_count)
+			except (KeyError, AssertionError, ValueError):
+				failure_count += 1
+				continue
+			rows.append(row)
+			parsed.append(obs)
+		if len(parsed) == 0:
+			self.stats.count('missed', failure_count)
+			return {} if count is not None else None
+		# count how many times each lock made each distinct observation
+		locks, lock_inverse = np.unique(rows, return_inverse=True)
+		unique_obs, obs_inverse = np.unique(parsed, return_inverse=True)
+		counts = np.zeros((len(locks), len(unique_obs)))
+		np.add.at(counts, (lock_inverse, obs_inverse), 1)
+		with self.stats.stage('likelihood'):
+			likelihood = np.array([Models.cached_likelihood_row(self.obs_model, int(obs), self._digit_count)
+								   for obs in unique_obs])
+		with self.stats.stage('normalize'):
+			# a likelihood of 0 rules a code out: keep it out of the product,
+			# since 0 * log(0) isn't 0, and mark those codes separately
+			zero = likelihood == 0
+			with np.errstate(divide='ignore'):
+				log_likelihood = np.where(zero, 0, np.log(likelihood))
+			log_update = counts @ log_likelihood
+			log_update[(counts @ zero) > 0] = -np.inf
+			with np.errstate(divide='ignore'):
+				log_posteriors = np.log(self._posteriors[locks]) + log_update
+			maximum = log_posteriors.max(axis=1, keepdims=True)
+			# locks whose observations have zero probability under every code
+			# are left untouched, just like CombinationLockCracker does
+			valid = np.isfinite(maximum[:, 0])
+			posteriors = np.exp(log_posteriors[valid] - maximum[valid])
+			posteriors /= posteriors.sum(axis=1, keepdims=True)
+			self._posteriors[locks[valid]] = posteriors
+		# the observations of the locks left untouched were missed too
+		observed = int(counts[valid].sum())
+		self.stats.count('observed', observed)
+		self.stats.count('missed', failure_count + len(parsed) - observed)
+		if count is not None:
+			return self.top_k(count, [self._lock_ids[row] for row in locks])
+
+	def prob(self, lock_id: Hashable, code: int) -> float:
+		"""
+		Returns the probability that code is the code of the given lock after
+		all the observations made.
+		"""
+		if not 0 <= code < self._posteriors.shape[1]:
+			return 0.0
+		return float(self._posteriors[self._lock_index[lock_id], code])
+
+	def rank(self, lock_id: Hashable, code: int) -> float:
+		"""
+		return the expected number of codes to try, from the most to the least
+		probable, until we try the given code on the given lock. Codes that are
+		equally probable are tried in a random order.
+		"""
+		posterior = self._posteriors[self._lock_index[lock_id]]
+		greater = np.count_nonzero(posterior > posterior[code])
+		equal = np.count_nonzero(posterior == posterior[code])
+		return greater + (equal + 1) / 2
+
+	def modes(self, lock_id: Hashable) -> list:
+		"""
+		return the mode(s) of the distribution of the given lock
+		"""
+		posterior = self._posteriors[self._lock_index[lock_id]]
+		return np.flatnonzero(posterior == posterior.max()).tolist()
+
+	def most_probables(self, lock_id: Hashable, count: int) -> dict:
+		"""
+		same as CombinationLockCracker.most_probables for the given lock
+		"""
+		posterior = self._posteriors[self._lock_index[lock_id]]
+		with self.stats.stage('top_k'):
+			most_probable = top_k_indices(posterior, count)
+		return {int(el): float(posterior[el]) for el in most_probable}
+
+	def top_k(self, count: int, lock_ids: Iterable = None) -> dict:
+		"""
+		return a dictionary mapping each lock id to its @count most probable
+		codes, see most_probables.
+
+		:param lock_ids: the locks to include, all of them by default
+		"""
+		if lock_ids is None:
+			lock_ids = self._lock_ids
+		return {lock_id: self.most_probables(lock_id, count) for lock_id in lock_ids}
@@ -0,0 +1,142 @@
+# times the hot paths of the cracker for every model factory of main.py
+# and writes the results as JSON, so that runs can be compared
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import numpy as np
+import main
+from typing import Callable
+from models import Models
+
+
+def max_rotation_distance(observation: int, actual: int, digit_count: int) -> int:
+	"""
+	the largest rotation needed on a single digit to go from observation
+	to actual. it is not a sum over digits, so models built with it go
+	through the pairwise build of Models.create_distance_model. like the
+	distance functions of Models, it also takes arrays of codes
+	"""
+	costs = Models.rotation_cost_table()[Models.digits(actual, digit_count), Models.digits(observation, digit_count)]
+	distances = costs.max(axis=-1)
+	return distances.item() if distances.ndim == 0 else distances
+
+
+def measure(func: Callable, repeat: int, setup: Callable = None) -> dict:
+	"""
+	call func repeat times and return statistics over the durations in
+	seconds. setup, if given, is called before each call and not timed.
+	"""
+	durations = []
+	for _ in range(repeat):
+		if setup is not None:
+			setup()
+		start = time.perf_counter()
+		func()
+		durations.append(time.perf_counter() - start)
+	return {'min': min(durations), 'mean': statistics.mean(durations), 'median': statistics.median(durations)}
+
+
+def benchmark_crackers(digit_counts: list, repeat: int, observation_count: int) -> list:
+	"""
+	time _observe, observe_list, most_probables and most_probable_adjacent
+	for every factory and digit count
+	"""
+	results = []
+	for model, factory in main.FACTORIES.items():
+		for digit_count in digit_counts:
+			observations = [random.randint(0, 10 ** digit_count - 1) for _ in range(observation_count)]
+			clc = factory(digit_count)
+			record = lambda name, seconds, **params: results.append(
+				{'name': name, 'model': model, 'digit_count': digit_count, 'params': params,
+				 'repeat': repeat, 'seconds': seconds})
+			record('create', measure(lambda: factory(digit_count), repeat))
+			# without clearing the likelihood cache, every call after the first
+			# would only time cache hits instead of computing the rows
+			record('_observe', measure(lambda: clc._observe(observations[0]), repeat,
+									   setup=Models.clear_likelihood_cache))
+			record('observe_list', measure(lambda: clc.observe_list(observations), repeat,
+										   setup=Models.clear_likelihood_cache),
+				   observation_count=observation_count)
+			record('most_probables', measure(lambda: clc.most_probables(100), repeat), count=100)
+			for max_distance in range(1, 5):
+				record('most_probable_adjacent', measure(lambda: clc.most_probable_adjacent(100, max_distance),
+														 repeat), count=100, max_distance=max_distance)
+	return results
+
+
+def benchmark_model_store(digit_counts: list, repeat: int) -> list:
+	"""
+	time building a pairwise distance model and loading it back, in a
+	temporary model directory
+	"""
+	results = []
+	model_directory = Models.MODEL_DIRECTORY
+	with tempfile.TemporaryDirectory() as directory:
+		Models.MODEL_DIRECTORY = directory
+		try:
+			for digit_count in digit_counts:
+				name = 'max_rotation_%ddigits' % digit_count
+				build = lambda: Models.build_distance_model(digit_count, max_rotation_distance, name)
+				load = lambda: Models.load_model(name)
+				for operation, func in (('build_distance_model', build), ('load_model', load)):
+					results.append({'name': operation, 'model': 'max_rotation', 'digit_count': digit_count,
+									'params': {}, 'repeat': repeat, 'seconds': measure(func, repeat)})
+		finally:
+			Models.MODEL_DIRECTORY = model_directory
+	return results
+
+
+def compare(previous: dict, current: dict, tolerance: float) -> list:
+	"""
+	return a description of every benchmark of current whose median is
+	more than tolerance times slower than the same benchmark in previous
+	"""
+	key = lambda result: (result['name'], result['model'], result['digit_count'],
+						  json.dumps(result['params'], sort_keys=True))
+	medians = {key(result): result['seconds']['median'] for result in previous['results']}
+	regressions = []
+	for result in current['results']:
+		before = medians.get(key(result))
+		after = result['seconds']['median']
+		if before is not None and after > tolerance * before:
+			regressions.append('%s %s %d digits %s: %.6fs -> %.6fs' % (key(result) + (before, after)))
+	return regressions
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='benchmark the combination lock cracker')
+	parser.add_argument('--digits', type=int, nargs='+', default=[3, 4, 5])
+	parser.add_argument('--build-digits', type=int, nargs='*', default=[2, 3])
+	parser.add_argument('--repeat', type=int, default=5)
+	parser.add_argument('--observations', type=int, default=20)
+	parser.add_argument('--seed', type=int, default=0)
+	parser.add_argument('--output', help='write the JSON results to this file instead of stdout')
+	parser.add_argument('--compare', help='a previous JSON result to check for regressions against')
+	parser.add_argument('--tolerance', type=float, default=1.5)
+	args = parser.parse_args()
+
+	random.seed(args.seed)
+	report = {
+		'meta': {'timestamp': time.time(), 'python': platform.python_version(), 'numpy': np.__version__,
+				 'platform': platform.platform(), 'cpu_count': os.cpu_count(), 'repeat': args.repeat,
+				 'seed': args.seed},
+		'results': benchmark_crackers(args.digits, args.repeat, args.observations) +
+				   benchmark_model_store(args.build_digits, args.repeat),
+	}
+	if args.output is None:
+		print(json.dumps(report, indent=2))
+	else:
+		with open(args.output, 'w') as f:
+			json.dump(report, f, indent=2)
+	if args.compare is not None:
+		with open(args.compare) as f:
+			regressions = compare(json.load(f), report, args.tolerance)
+		for regression in regressions:
+			print('regression: ' + regression, file=sys.stderr)
+		sys.exit(1 if regressions else 0)
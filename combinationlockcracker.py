@@ -1,6 +1,10 @@
+import numpy as np
+import utils
+from functools import lru_cache
 from typing import Callable, Iterable
-from distribution import Distribution
 from models import Models
+from stats import Stats
+from topk import top_k_indices
 
 
 class CombinationLockCracker:
@@ -26,7 +30,14 @@ class CombinationLockCracker:
 	say somewhere between 20 to 100.
 	"""
 
-	def __init__(self, digit_count: int, observation_model: Callable, observations: list = None) -> None:
+	# in sparse mode, the first observation goes over the codes in chunks of
+	# this size so that no array of 10^digit_count entries is ever allocated
+	SPARSE_CHUNK_SIZE = 10 ** 6
+
+	def __init__(self, digit_count: int, observation_model: Callable, observations: list = None,
+				 log_space: bool = False, sparse_epsilon: float = None, sparse_top: int = None,
+				 stats: Stats = None, crack_count: int = 20, crack_mass: float = None, crack_entropy: float = None,
+				 on_cracked: Callable = None, stop_when_cracked: bool = True, state: dict = None) -> None:
 		"""
 		initialize the combination lock cracker
 
@@ -35,42 +46,204 @@ class CombinationLockCracker:
 			a function of two parameters, obs and key. This returns the
 			probability of observing obs given key is the true code.
 		:param observations: a list of strings representing observations
+		:param log_space:
+			if True, observe_list accumulates the log-likelihoods of the
+			whole list and normalizes once with log-sum-exp. This keeps the
+			posterior stable for long lists of observations and large locks.
+		:param sparse_epsilon:
+			if given, use the sparse mode: after every observation, codes whose
+			probability is below sparse_epsilon are dropped and their mass is
+			tracked as a single discarded mass, spread evenly over them. Later
+			observations only go over the surviving codes, which is what makes
+			locks of 7 or 8 digits fit in memory. A dropped code never comes
+			back, so a larger epsilon is faster but less accurate.
+		:param sparse_top:
+			if given, use the sparse mode and also drop every code outside the
+			sparse_top most probable ones. The most probable code is always kept.
+		:param stats:
+			if given, record the number of observations observed and missed and
+			the time spent in each stage of the updates and queries in it (see
+			Stats). self.stats is a disabled Stats otherwise.
+		:param crack_count: the number of most probable codes crack_mass is about
+		:param crack_mass:
+			if given, the lock is cracked once its crack_count most probable codes
+			hold at least that much probability (see top_mass)
+		:param crack_entropy:
+			if given, the lock is cracked once the entropy of the posterior, in
+			bits, is at most that much (see entropy). Either threshold cracks it.
+		:param on_cracked:
+			called with this cracker once, after the observation that cracked it.
+			self.cracked then stays True until reset.
+		:param stop_when_cracked:
+			if True, observe_list and observe_stream stop consuming observations
+			once the lock is cracked, and ignore any later observations
+		:param state:
+			if given, a state returned by state() to start from instead of the
+			uniform posterior. the lock is cracked if it was when the state was
+			taken, without calling on_cracked. observations are observed after it.
 		"""
+		assert sparse_epsilon is None or sparse_epsilon >= 0, 'sparse_epsilon must be non-negative'
+		assert sparse_top is None or sparse_top >= 1, 'sparse_top must be at least 1'
 		self._digit_count: int = digit_count
-		self._possible_combinations = {i for i in range(10 ** digit_count)}
 		self.obs_model = observation_model
+		self.stats: Stats = Stats(enabled=False) if stats is None else stats
 		self._observations: list = []
-		self._dist: Distribution = None
-		self.build_distribution()
+		self._log_space: bool = log_space
+		self._sparse_epsilon: float = sparse_epsilon
+		self._sparse_top: int = sparse_top
+		self._sparse: bool = sparse_epsilon is not None or sparse_top is not None
+		assert not (self._sparse and log_space), 'the sparse mode cannot be used in log space'
+		self._crack_count: int = crack_count
+		self._crack_mass: float = crack_mass
+		self._crack_entropy: float = crack_entropy
+		self._on_cracked: Callable = on_cracked
+		self._stop_when_cracked: bool = stop_when_cracked
+		# only checked after every observation when a threshold is given
+		self._crack_mode: bool = crack_mass is not None or crack_entropy is not None
+		self.cracked: bool = False
+		# the posterior is a dense array indexed by code. in log space,
+		# we keep the log posterior and derive the posterior from it
+		self._posterior: np.ndarray = None
+		self._log_posterior: np.ndarray = None
+		# in sparse mode, the posterior is only kept for the sorted codes of
+		# _support, and the rest of the mass is _discarded_mass. a support of
+		# None means that no code was dropped yet and the posterior is uniform
+		self._support: np.ndarray = None
+		self._discarded_mass: float = 0.0
+		# digit marginals, computed on demand and cleared on every update
+		self._marginals: np.ndarray = None
+		if state is None:
+			self.build_distribution()
+		else:
+			self._load_state(state)
 		self.observe_list(observations)
 
 	def build_distribution(self, reset: bool = False) -> None:
-		# distribution class will normalize
-		self._dist = Distribution({i: 1 for i in range(10 ** self._digit_count)})
+		sample_space_size = 10 ** self._digit_count
+		self._marginals = None
+		self.cracked = False
+		if self._sparse:
+			self._posterior, self._support, self._discarded_mass = None, None, 0.0
+		else:
+			self._posterior = np.full(sample_space_size, 1 / sample_space_size)
+		if self._log_space:
+			self._log_posterior = np.log(self._posterior)
 		if reset:
 			self._observations = []
 
-	def observe_list(self, observations: Iterable = None) -> None:
+	def observe_list(self, observations: Iterable = None) -> tuple:
 		"""
 		based on a list of observations, update our belief about the
 		code. We will always observe through a list and not directly
-		observe an observation.
+		observe an observation. In log space, the whole list is observed
+		as a single batch (see observe_stream), unless a crack threshold was
+		given (see __init__): the lock is then checked after every observation,
+		and observing stops once it is cracked if stop_when_cracked is True.
 
 		:param observations: a list of strings representing lock combinations observed
+		:return: the number of observations that were observed and missed
 		"""
-		success_count, failure_count = 0, 0
 		if observations is None:
-			return
+			return 0, 0
 		# ensure we can iteration through observations
 		assert isinstance(observations, Iterable), 'observations must be iterable'
-		for obs in observations:
+		if self._log_space:
+			return self.observe_stream(observations, batch_size=1 if self._crack_mode else None)
+		success_count, failure_count = 0, 0
+		# see observe_stream for why the check comes after each observation
+		stop = lambda: self.cracked and self._stop_when_cracked
+		for obs in () if stop() else observations:
 			try:
 				self._observe(obs)
 				success_count += 1
-			except:
+			except (AssertionError, ValueError):
 				failure_count += 1
-				print('missed observation -> ' + str(obs))
-		print("observed %d out of %d" % (success_count, success_count + failure_count))
+				continue
+			self._check_cracked()
+			if stop():
+				break
+		self.stats.count('observed', success_count)
+		self.stats.count('missed', failure_count)
+		return success_count, failure_count
+
+	def observe_stream(self, observations: Iterable, batch_size: int = 1000) -> tuple:
+		"""
+		same as observe_list, except that the observations are consumed lazily
+		(for instance from LockCData.stream_data) and observed in micro-batches
+		of batch_size observations, with one normalization per micro-batch
+		(see _observe_batch). So, memory doesn't grow with the number of
+		observations. Invalid observations are only reported as a count. A
+		crack threshold (see __init__) is checked after every micro-batch.
+
+		:param observations: an iterable of strings representing lock combinations observed
+		:param batch_size: the number of observations per micro-batch, None for a single batch
+		:return: the number of observations that were observed and missed
+		"""
+		success_count, failure_count = 0, 0
+		batch = []
+		# the check comes before taking the next observation, so that none is
+		# consumed without being observed once the lock is cracked
+		stop = lambda: self.cracked and self._stop_when_cracked
+		for obs in () if stop() else observations:
+			try:
+				batch.append(self._parse_observation(obs))
+			except (AssertionError, ValueError):
+				failure_count += 1
+			if batch_size is not None and len(batch) >= batch_size:
+				observed = self._try_observe_batch(batch)
+				success_count, failure_count = success_count + observed, failure_count + len(batch) - observed
+				batch = []
+				if observed > 0:
+					self._check_cracked()
+				if stop():
+					break
+		observed = self._try_observe_batch(batch)
+		success_count, failure_count = success_count + observed, failure_count + len(batch) - observed
+		if observed > 0:
+			self._check_cracked()
+		self.stats.count('observed', success_count)
+		self.stats.count('missed', failure_count)
+		return success_count, failure_count
+
+	def _check_cracked(self) -> None:
+		"""
+		check whether the lock is now cracked (see __init__), and if so, mark
+		it as cracked and call on_cracked
+		"""
+		if self.cracked or not self._crack_mode:
+			return
+		with self.stats.stage('confidence'):
+			cracked = (self._crack_mass is not None and self.top_mass(self._crack_count) >= self._crack_mass) or \
+					  (self._crack_entropy is not None and self.entropy() <= self._crack_entropy)
+		if cracked:
+			self.cracked = True
+			self.stats.count('cracked')
+			if self._on_cracked is not None:
+				self._on_cracked(self)
+
+	def _try_observe_batch(self, observations: list) -> int:
+		"""
+		observe a batch with _observe_batch and return how many observations
+		were observed, which is 0 if the batch was missed. In sparse mode, and
+		for models that learn from every observation (see _update_model), the
+		observations are observed one at a time and in order instead, so that
+		each one is learned from the posterior right before it.
+		"""
+		if self._sparse or hasattr(self.obs_model, 'update_weights'):
+			observe = self._observe_sparse if self._sparse else lambda observation: self._observe_batch([observation])
+			observed = 0
+			for observation in observations:
+				try:
+					observe(observation)
+					observed += 1
+				except ValueError:
+					pass
+			return observed
+		try:
+			self._observe_batch(observations)
+			return len(observations)
+		except ValueError:
+			return 0
 
 	def _observe(self, observation: str) -> None:
 		"""
@@ -86,27 +259,202 @@ class CombinationLockCracker:
 
 		:param observation: a string representing a single observation
 		"""
+		observation = self._parse_observation(observation)
+		if self._sparse:
+			self._observe_sparse(observation)
+			return
+		if self._log_space:
+			self._observe_batch([observation])
+			return
+		# now, update the distribution using bayesian update and
+		# observation model given at initialization. the likelihood
+		# row is applied in place once we know the update is valid
+		likelihood = self._likelihood_row(observation)
+		with self.stats.stage('normalize'):
+			total = float(np.dot(self._posterior, likelihood))
+		if not total > 0:
+			raise ValueError('observation %d has zero probability under every code' % observation)
+		self._update_model(observation, self._posterior)
+		with self.stats.stage('normalize'):
+			self._posterior *= likelihood
+			self._posterior /= total
+		self._observations.append(observation)
+		self._marginals = None
+
+	def _observe_sparse(self, observation: int) -> None:
+		"""
+		same as _observe in sparse mode. the surviving codes are updated with
+		their own likelihood. the discarded codes are assumed to share the
+		discarded mass evenly, so their update only needs the sum of their
+		likelihoods, which is the sum over every code (see
+		Models.likelihood_total) minus the sum over the surviving codes.
+
+		:param observation: an integer representing a single observation
+		"""
+		sample_space_size = 10 ** self._digit_count
+		with self.stats.stage('likelihood'):
+			total = Models.likelihood_total(self.obs_model, observation, self._digit_count)
+		if self._support is None:
+			# the posterior is still uniform, so it becomes the normalized
+			# likelihood row, which we prune one chunk at a time
+			if not total > 0:
+				raise ValueError('observation %d has zero probability under every code' % observation)
+			supports, posteriors = [], []
+			for start in range(0, sample_space_size, CombinationLockCracker.SPARSE_CHUNK_SIZE):
+				codes = np.arange(start, min(start + CombinationLockCracker.SPARSE_CHUNK_SIZE, sample_space_size))
+				with self.stats.stage('likelihood'):
+					posterior = Models.likelihood_row(self.obs_model, observation, self._digit_count, codes) / total
+				codes, posterior = self._prune(codes, posterior)
+				supports.append(codes)
+				posteriors.append(posterior)
+			support, posterior = self._prune(np.concatenate(supports), np.concatenate(posteriors))
+			discarded_mass = max(1 - float(posterior.sum()), 0.0)
+			self._update_model(observation, None)
+		else:
+			with self.stats.stage('likelihood'):
+				likelihood = Models.likelihood_row(self.obs_model, observation, self._digit_count, self._support)
+			discarded_count = sample_space_size - len(self._support)
+			discarded_mass = 0.0 if discarded_count == 0 else \
+				self._discarded_mass / discarded_count * max(total - float(likelihood.sum()), 0.0)
+			with self.stats.stage('normalize'):
+				posterior = self._posterior * likelihood
+				total = float(posterior.sum()) + discarded_mass
+			if not total > 0:
+				raise ValueError('observation %d has zero probability under every code' % observation)
+			self._update_model(observation, self._posterior, self._support)
+			with self.stats.stage('normalize'):
+				posterior /= total
+			kept_support, kept_posterior = self._prune(self._support, posterior)
+			discarded_mass = discarded_mass / total + float(posterior.sum() - kept_posterior.sum())
+			support, posterior = kept_support, kept_posterior
+		self._support, self._posterior, self._discarded_mass = support, posterior, discarded_mass
+		self._observations.append(observation)
+		self._marginals = None
+
+	def _prune(self, codes: np.ndarray, posterior: np.ndarray) -> tuple:
+		"""
+		return the codes and their posterior, in the same order, without the
+		codes that the sparse mode drops. the most probable code is always kept.
+
+		:param codes: the codes
+		:param posterior: the probability of each code
+		"""
+		with self.stats.stage('prune'):
+			keep = np.ones(len(codes), dtype=bool)
+			if self._sparse_epsilon is not None:
+				keep &= posterior >= self._sparse_epsilon
+			if self._sparse_top is not None and np.count_nonzero(keep) > self._sparse_top:
+				top = np.zeros(len(codes), dtype=bool)
+				top[top_k_indices(np.where(keep, posterior, -np.inf), self._sparse_top)] = True
+				keep &= top
+			keep[np.argmax(posterior)] = True
+			return codes[keep], posterior[keep]
+
+	def _dense_posterior(self) -> np.ndarray:
+		"""
+		return the posterior as an array indexed by code. in sparse mode, this
+		allocates the array and spreads the discarded mass over the discarded
+		codes, so it should only be used by queries over every code.
+		"""
+		if not self._sparse:
+			return self._posterior
+		sample_space_size = 10 ** self._digit_count
+		with self.stats.stage('copy'):
+			if self._support is None:
+				return np.full(sample_space_size, 1 / sample_space_size)
+			discarded_count = sample_space_size - len(self._support)
+			posterior = np.full(sample_space_size, self._discarded_mass / discarded_count if discarded_count else 0.0)
+			posterior[self._support] = self._posterior
+			return posterior
+
+	def _observe_batch(self, observations: list) -> None:
+		"""
+		same as _observe but for a whole batch of parsed observations at
+		once in log space: we sum the log-likelihoods of every observation,
+		add them to the log posterior and normalize once with log-sum-exp.
+		Nothing is updated if the batch has zero probability under every code.
+		Outside of log space, we take the log of the posterior first. An
+		observation made k times in the batch adds k times its log-likelihood.
+
+		:param observations: a list of integers representing observations
+		"""
+		if len(observations) == 0:
+			return
+		log_likelihood = np.zeros(10 ** self._digit_count)
+		unique_observations, counts = np.unique(observations, return_counts=True)
+		for observation, count in zip(unique_observations.tolist(), counts.tolist()):
+			log_likelihood += count * self._likelihood_row(observation, log=True)
+		with self.stats.stage('normalize'):
+			# a posterior of 0 rules the code out, so log(0) = -inf is expected
+			with np.errstate(divide='ignore'):
+				log_posterior = self._log_posterior if self._log_space else np.log(self._posterior)
+			log_posterior = log_posterior + log_likelihood
+			log_total = utils.logsumexp(log_posterior)
+		if not np.isfinite(log_total):
+			raise ValueError('observations have zero probability under every code')
+		# models that learn only get batches of one observation, see _try_observe_batch
+		for observation in observations:
+			self._update_model(observation, self._posterior)
+		with self.stats.stage('normalize'):
+			log_posterior -= log_total
+			if self._log_space:
+				self._log_posterior = log_posterior
+			self._posterior = np.exp(log_posterior)
+		self._observations.extend(observations)
+		self._marginals = None
+
+	def _update_model(self, observation: int, posterior: np.ndarray, codes: np.ndarray = None) -> None:
+		"""
+		let the observation model learn from an observation that is about to
+		be observed, if it can (see Models.create_mixture_model)
+
+		:param observation: an integer representing a single observation
+		:param posterior: the posterior before the observation, None if uniform
+		:param codes: the codes of the posterior in sparse mode
+		"""
+		update_weights = getattr(self.obs_model, 'update_weights', None)
+		if update_weights is not None:
+			update_weights(observation, posterior, codes)
+
+	def _parse_observation(self, observation: str or int) -> int:
+		"""
+		see CombinationLockCracker.parse_observation
+		"""
+		return CombinationLockCracker.parse_observation(observation, self._digit_count)
+
+	@staticmethod
+	def parse_observation(observation: str or int, digit_count: int) -> int:
+		"""
+		return the observation as an integer after having ensured that it is
+		a valid lock combination with digit_count digits. this raises an error
+		otherwise.
+
+		:param observation: a string or integer representing a single observation
+		:param digit_count: the number of digits in the combination
+		"""
 		# if the number is not a string, convert it to string
 		# the following throws an error if we're given an
 		# invalid number that cannot become a string
-		if type(observation) == str:
-			# ensure the length of it is correct, then observe
-			assert len(observation) <= self._digit_count
-			observation = int(observation)
-		elif type(observation) == int:
-			# observe it as a string to ensure it has the right length
-			self._observe(str(observation))
-			return
-		else:
+		if type(observation) == int:
+			# parse it as a string to ensure it has the right length
+			observation = str(observation)
+		if type(observation) != str:
 			raise AssertionError('invalid observation type')
-		# now, update the distribution using bayesian update and
-		# observation model given at initialization
-		dist_copy = self._dist.copy()
-		for el in self._dist:
-			new_prob = self.obs_model(observation, el) * self._dist.prob(el)
-			dist_copy.set(el, new_prob, normalize=False)
-		dist_copy.normalize()
-		self._dist = dist_copy
+		# ensure the length of it is correct
+		assert len(observation) <= digit_count
+		observation = int(observation)
+		assert observation >= 0, 'observation must be non-negative'
+		return observation
+
+	def _likelihood_row(self, observation: int, log: bool = False) -> np.ndarray:
+		"""
+		see Models.cached_likelihood_row
+
+		:param observation: an integer representing a single observation
+		:param log: whether to return the log of the row
+		"""
+		with self.stats.stage('likelihood'):
+			return Models.cached_likelihood_row(self.obs_model, observation, self._digit_count, log)
 
 	def reset(self) -> None:
 		"""
@@ -114,18 +462,178 @@ class CombinationLockCracker:
 		"""
 		self.build_distribution(reset=True)
 
+	def options(self) -> dict:
+		"""
+		return the keyword arguments of __init__ that set the mode and the crack
+		thresholds of this session, to create another one like it. on_cracked
+		and stats aren't part of them.
+		"""
+		return {'log_space': self._log_space, 'sparse_epsilon': self._sparse_epsilon,
+				'sparse_top': self._sparse_top, 'crack_count': self._crack_count,
+				'crack_mass': self._crack_mass, 'crack_entropy': self._crack_entropy,
+				'stop_when_cracked': self._stop_when_cracked}
+
+	def state(self) -> dict:
+		"""
+		return a copy of what this session has learned: the posterior (the log
+		posterior in log space, the posterior of the support in sparse mode),
+		the support and the discarded mass in sparse mode, the observations made
+		so far and whether the lock is cracked. load it with load_state or the
+		state argument of __init__, in a session with the same options (see options).
+		"""
+		posterior = self._log_posterior if self._log_space else self._posterior
+		state = {'log_space': self._log_space, 'sparse': self._sparse,
+				 'posterior': None if posterior is None else posterior.copy(),
+				 'observations': list(self._observations), 'cracked': self.cracked}
+		if self._sparse:
+			state.update(support=None if self._support is None else self._support.copy(),
+						 discarded_mass=self._discarded_mass)
+		return state
+
+	def load_state(self, state: dict) -> None:
+		"""
+		replace what this session has learned with a state returned by state(),
+		for instance by a session that observed in another process. if the
+		state is cracked and this session wasn't, on_cracked is called as if
+		this session had observed what cracked it.
+
+		:param state: the state to load, taken in the same mode as this session
+		"""
+		cracked = self.cracked
+		self._load_state(state)
+		if self.cracked and not cracked:
+			self.stats.count('cracked')
+			if self._on_cracked is not None:
+				self._on_cracked(self)
+
+	def _load_state(self, state: dict) -> None:
+		assert state['log_space'] == self._log_space and state['sparse'] == self._sparse, \
+			'the state was taken in another mode'
+		posterior = None if state['posterior'] is None else np.array(state['posterior'], dtype=np.float64)
+		self._marginals = None
+		if self._sparse:
+			self._posterior, self._discarded_mass = posterior, float(state['discarded_mass'])
+			self._support = None if state['support'] is None else np.array(state['support'], dtype=np.int64)
+		elif self._log_space:
+			self._log_posterior, self._posterior = posterior, np.exp(posterior)
+		else:
+			self._posterior = posterior
+		self._observations = list(state['observations'])
+		self.cracked = bool(state['cracked'])
+
+	def snapshot(self, path: str) -> None:
+		"""
+		save this session to path in NumPy's binary .npz format: the posterior
+		(the log posterior in log space), the observations made so far and the
+		name of the observation model (see Models). restore it with
+		CombinationLockCracker.restore and only observe the new observations.
+		In sparse mode, the posterior of the surviving codes is saved along with
+		the support, the discarded mass and the sparse settings. The crack
+		thresholds (see __init__) and whether the lock is cracked are saved
+		too, but not on_cracked and stats, which restore takes again. The name
+		is what tells which model a snapshot can be restored with, so a model
+		without a model_name attribute can't be snapshotted.
+
+		:param path: the file to write the snapshot to
+		"""
+		model_name = getattr(self.obs_model, 'model_name', None)
+		if model_name is None:
+			raise ValueError('only a model with a model_name can be snapshotted')
+		posterior = self._log_posterior if self._log_space else self._posterior
+		sparse = {}
+		if self._sparse:
+			no_support = self._support is None
+			posterior = np.zeros(0) if no_support else posterior
+			sparse = {'support': np.zeros(0, dtype=np.int64) if no_support else self._support,
+					  'discarded_mass': self._discarded_mass,
+					  'sparse_epsilon': np.nan if self._sparse_epsilon is None else self._sparse_epsilon,
+					  'sparse_top': -1 if self._sparse_top is None else self._sparse_top}
+		with open(path, 'wb') as f:
+			np.savez(f, posterior=posterior,
+					 observations=np.array(self._observations, dtype=np.int64),
+					 digit_count=self._digit_count, log_space=self._log_space,
+					 model_name=str(model_name), crack_count=self._crack_count,
+					 crack_mass=np.nan if self._crack_mass is None else self._crack_mass,
+					 crack_entropy=np.nan if self._crack_entropy is None else self._crack_entropy,
+					 stop_when_cracked=self._stop_when_cracked, cracked=self.cracked, **sparse)
+
+	@staticmethod
+	def restore(path: str, observation_model: Callable, on_cracked: Callable = None, stats: Stats = None):
+		"""
+		restore a session saved with snapshot. the observation model can't be
+		saved, so it must be given again and have the same name as the one of
+		the saved session. a snapshot or model without a name is refused. the
+		same goes for on_cracked and stats, which aren't saved either.
+
+		:param path: the file the snapshot was written to
+		:param observation_model: see __init__
+		:param on_cracked: see __init__
+		:param stats: see __init__
+		"""
+		with np.load(path) as snapshot:
+			model_name, snapshot_name = getattr(observation_model, 'model_name', None), str(snapshot['model_name'])
+			if model_name is None:
+				raise ValueError('only a model with a model_name can restore a snapshot')
+			# snapshots of unnamed models used to be saved under the name None
+			if snapshot_name == 'None':
+				raise ValueError('the snapshot was made with a model without a name')
+			if str(model_name) != snapshot_name:
+				raise ValueError('the snapshot was made with the model %s, not %s' % (snapshot_name, model_name))
+			sparse_epsilon, sparse_top = None, None
+			if 'support' in snapshot.files:
+				sparse_epsilon, sparse_top = float(snapshot['sparse_epsilon']), int(snapshot['sparse_top'])
+				sparse_epsilon = None if np.isnan(sparse_epsilon) else sparse_epsilon
+				sparse_top = None if sparse_top < 0 else sparse_top
+			# snapshots made before the crack thresholds were saved have the defaults
+			crack = {'crack_count': 20, 'crack_mass': np.nan, 'crack_entropy': np.nan,
+					 'stop_when_cracked': True, 'cracked': False}
+			crack.update({key: snapshot[key].item() for key in crack if key in snapshot.files})
+			crack_mass, crack_entropy = crack['crack_mass'], crack['crack_entropy']
+			log_space, sparse = bool(snapshot['log_space']), 'support' in snapshot.files
+			state = {'log_space': log_space, 'sparse': sparse, 'posterior': snapshot['posterior'],
+					 'observations': snapshot['observations'].tolist(), 'cracked': crack['cracked']}
+			# an empty support is the uniform posterior of a sparse session
+			if sparse:
+				no_support = len(snapshot['support']) == 0
+				state.update(support=None if no_support else snapshot['support'],
+							 discarded_mass=float(snapshot['discarded_mass']))
+				state['posterior'] = None if no_support else state['posterior']
+			clc = CombinationLockCracker(int(snapshot['digit_count']), observation_model, log_space=log_space,
+										 sparse_epsilon=sparse_epsilon, sparse_top=sparse_top, stats=stats,
+										 crack_count=int(crack['crack_count']),
+										 crack_mass=None if np.isnan(crack_mass) else float(crack_mass),
+										 crack_entropy=None if np.isnan(crack_entropy) else float(crack_entropy),
+										 on_cracked=on_cracked, stop_when_cracked=bool(crack['stop_when_cracked']),
+										 state=state)
+		return clc
+
 	def modes(self) -> list:
 		"""
-		return the mode(s) of the distribution
+		return the mode(s) of the distribution. in sparse mode, only the
+		surviving codes are considered.
 		"""
-		return self._dist.modes()
+		if self._sparse and self._support is not None:
+			return self._support[self._posterior == self._posterior.max()].tolist()
+		posterior = self._dense_posterior()
+		return np.flatnonzero(posterior == posterior.max()).tolist()
 
 	def prob(self, code: int) -> float:
 		"""
 		Returns the probability of getting the given code after all
 		the observations made.
 		"""
-		return self._dist.prob(code)
+		sample_space_size = 10 ** self._digit_count
+		if not 0 <= code < sample_space_size:
+			return 0.0
+		if not self._sparse:
+			return float(self._posterior[code])
+		if self._support is None:
+			return 1 / sample_space_size
+		# a discarded code gets its share of the discarded mass
+		index = np.searchsorted(self._support, code)
+		if index < len(self._support) and self._support[index] == code:
+			return float(self._posterior[index])
+		return self._discarded_mass / (sample_space_size - len(self._support))
 
 	def most_probables(self, count: int) -> dict:
 		"""
@@ -133,28 +641,121 @@ class CombinationLockCracker:
 
 		:param count: how many to include in the set of most probable codes
 		"""
-		most_probable = self._dist.most_probable(count)
-		return {el: self._dist.prob(el) for el in most_probable}
+		if self._sparse and self._support is not None:
+			# in sparse mode, only the surviving codes are considered
+			with self.stats.stage('top_k'):
+				most_probable = top_k_indices(self._posterior, count)
+			return {int(self._support[el]): float(self._posterior[el]) for el in most_probable}
+		posterior = self._dense_posterior()
+		with self.stats.stage('top_k'):
+			most_probable = top_k_indices(posterior, count)
+		return {int(el): float(posterior[el]) for el in most_probable}
+
+	def top_mass(self, count: int) -> float:
+		"""
+		return the probability that the code is one of the @count most probable
+		codes (see most_probables)
+		"""
+		return float(sum(self.most_probables(count).values()))
+
+	def entropy(self) -> float:
+		"""
+		return the entropy of the posterior in bits: the log2 of the number of
+		codes left, if they were equally probable. in sparse mode, the
+		discarded mass is spread evenly over the discarded codes.
+		"""
+		sample_space_size = 10 ** self._digit_count
+		if self._sparse and self._support is None:
+			return float(np.log2(sample_space_size))
+		posterior = self._posterior[self._posterior > 0]
+		entropy = -float(posterior @ np.log2(posterior))
+		discarded_count = sample_space_size - len(self._support) if self._sparse else 0
+		if discarded_count > 0 and self._discarded_mass > 0:
+			entropy -= self._discarded_mass * np.log2(self._discarded_mass / discarded_count)
+		return float(entropy)
+
+	def trial_plan(self, count: int) -> list:
+		"""
+		return the first @count codes to physically try on the lock, in order,
+		as a list of (code, probability that the code opens the lock given that
+		every code tried before it failed).
+
+		A failed trial rules its code out, like an observation of the code
+		under the black and white model would if PROB were 0. That leaves the
+		other codes in the same proportions, so trying codes from the most to
+		the least probable minimizes the expected number of attempts, and the
+		probabilities after each failure only need the mass tried so far,
+		without updating the posterior.
+
+		:param count: how many trials to plan
+		"""
+		most_probable = self.most_probables(count)
+		probs = np.fromiter(most_probable.values(), dtype=np.float64, count=len(most_probable))
+		# the mass left once the previous trials failed
+		remaining = 1 - np.concatenate([[0.0], np.cumsum(probs)[:-1]])
+		remaining = np.maximum(remaining, probs)
+		success = np.divide(probs, remaining, out=np.zeros_like(probs), where=remaining > 0)
+		return list(zip(most_probable.keys(), success.tolist()))
+
+	def expected_attempts(self) -> float:
+		"""
+		return the expected number of codes tried until the lock opens when
+		trying every code in the order of trial_plan. in sparse mode, the
+		discarded codes are assumed to be tried after the surviving ones.
+		"""
+		if self._sparse and self._support is not None:
+			sample_space_size, surviving = 10 ** self._digit_count, len(self._support)
+			attempts = float(np.sort(self._posterior)[::-1] @ np.arange(1, surviving + 1))
+			if surviving < sample_space_size:
+				# each discarded code is tried at one of the last positions
+				each = self._discarded_mass / (sample_space_size - surviving)
+				attempts += each * (sample_space_size * (sample_space_size + 1) - surviving * (surviving + 1)) / 2
+			return attempts
+		posterior = np.sort(self._dense_posterior())[::-1]
+		return float(posterior @ np.arange(1, len(posterior) + 1))
 
 	def digit_prob(self, index: int, digit: int) -> float:
 		"""
-		return the probability of seeing digit at the index given
-		todo - implement this
+		return the probability of seeing digit at the index given, where
+		index 0 is the leftmost digit of the code
 		"""
 		assert index < self._digit_count, 'index must be less than the digit count -> %s >= %s' \
 										  % (str(index), str(self._digit_count))
 		assert 0 <= digit < 10, 'digit must be in the range [0, 9] -> %d' % digit
-		raise NotImplementedError
+		return float(self.digit_marginals()[index, digit])
 
 	def most_probable_digits(self, count: int) -> dict:
 		"""
-		same as most_probables, except this is for each digit in the code
+		same as most_probables, except this is for each digit in the code.
+		this returns a dictionary mapping each index to a dictionary mapping
+		its most probable digits to their probabilities.
 
 		:param count:
 			how many to include for each index in the set of most probable digits
-		todo - implement this
 		"""
-		raise NotImplementedError
+		marginals = self.digit_marginals()
+		return {index: {int(digit): float(marginals[index, digit])
+						for digit in top_k_indices(marginals[index], count)}
+				for index in range(self._digit_count)}
+
+	def digit_marginals(self) -> np.ndarray:
+		"""
+		return the (digit_count, 10) table such that table[index][digit] is the
+		probability of seeing digit at the index. The table is cached until
+		the next observation, so repeated queries don't scan the posterior.
+		"""
+		if self._marginals is None:
+			with self.stats.stage('marginals'):
+				# partial[i] is the posterior summed over the digits after index i,
+				# so each sum only goes over the previous (smaller) partial sum
+				partial = [None] * self._digit_count
+				partial[-1] = self._dense_posterior().reshape((10,) * self._digit_count)
+				for i in range(self._digit_count - 2, -1, -1):
+					partial[i] = partial[i + 1].sum(axis=-1)
+				self._marginals = np.array([partial[i].reshape(-1, 10).sum(axis=0)
+											for i in range(self._digit_count)])
+				self._marginals.setflags(write=False)
+		return self._marginals
 
 	def most_probable_adjacent(self, count: int, max_distance: int = 2) -> dict:
 		"""
@@ -170,53 +771,110 @@ class CombinationLockCracker:
 			then for each element el, we will look at all codes distant by 1
 			from el, distant by 2, then distant by 3.
 		"""
-		histogram = {}
 		# calibrate the maximum distance to be limited
 		# to 9 and ensure it's an integer
 		max_distance = int(max(min(max_distance, 9), 1))
-		for el in range(10 ** self._digit_count):
-			s_el = Models.extend_integer(el, self._digit_count)
-			prob = self.prob(el)
-			histogram[el] = histogram.get(el, 0) + prob
-			# add histogram for changes for each valid edit_distance
-			for edit_distance in range(1, max_distance + 1):
-				for el_with_edit in CombinationLockCracker.generate_edits(s_el, distance=edit_distance):
-					i_el = int(el_with_edit)
-					histogram[i_el] = histogram.get(i_el, 0) + (prob / edit_distance)
-		# finally, return the most probable from a new
-		# distribution created through the histogram
-		dist = Distribution(histogram)
-		most_probable = dist.most_probable(count)
-		return {el: dist.prob(el) for el in most_probable}
+		with self.stats.stage('adjacency'):
+			histogram = self._adjacency_histogram(max_distance)
+		# finally, return the most probable from the normalized "histogram"
+		with self.stats.stage('normalize'):
+			histogram /= histogram.sum()
+		with self.stats.stage('top_k'):
+			most_probable = top_k_indices(histogram, count)
+		return {int(el): float(histogram[el]) for el in most_probable}
+
+	def _adjacency_histogram(self, max_distance: int) -> np.ndarray:
+		"""
+		return the "histogram" of most_probable_adjacent as an array indexed by
+		code, without enumerating the edits of each code. Adding prob / d to
+		every code at edit distance d is a circular convolution of the
+		posterior, seen as a tensor with one axis of size 10 per digit. We
+		apply it one axis at a time: after processing some axes, by_distance[t]
+		is the sum of the posterior shifted by every offset of those axes whose
+		rotations add up to t (see Models.replace_cost_by_rotations).
+
+		:param max_distance: see most_probable_adjacent
+		"""
+		tensor = self._dense_posterior().reshape((10,) * self._digit_count)
+		by_distance = [tensor] + [np.zeros_like(tensor) for _ in range(max_distance)]
+		for axis in range(self._digit_count):
+			shifted = [np.zeros_like(tensor) for _ in range(max_distance + 1)]
+			for distance in range(max_distance + 1):
+				# rotating this digit by c costs c, and both ways cost the same
+				for c in range(min(distance, 5) + 1):
+					previous = by_distance[distance - c]
+					shifted[distance] += np.roll(previous, c, axis=axis)
+					if 0 < c < 5:
+						shifted[distance] += np.roll(previous, -c, axis=axis)
+			by_distance = shifted
+		histogram = by_distance[0].copy()
+		for distance in range(1, max_distance + 1):
+			histogram += by_distance[distance] / distance
+		return histogram.ravel()
 
 	@staticmethod
 	def generate_edits(s_el: str, distance=1, no_use_set=None) -> set:
 		"""
 		generates all possible edits by the distance given of the string
-		integer s_el.
+		integer s_el. see CombinationLockCracker.codes_at_distance.
 
 		:param s_el: string representing a lock combination
 		:param distance: the desired distance from the initial number
 		:param no_use_set:
 			set containing all the edits not to use in the returned set
 		"""
-		if no_use_set is None:
-			no_use_set = {s_el}
 		if distance < 1:
 			return {s_el}
-		# create edit by 1
-		edits_by_1 = set()
-		for i in range(len(s_el)):
-			digit = int(s_el[i])
-			edits_by_1.add(s_el[:i] + str((digit + 1) % 10) + s_el[i + 1:])
-			edits_by_1.add(s_el[:i] + str((digit - 1) % 10) + s_el[i + 1:])
-		# generate edits recursively
-		all_edits = set()
-		for el in edits_by_1:
-			others = CombinationLockCracker.generate_edits(el, distance - 1, no_use_set)
-			all_edits |= others
-		# remove the ones that we don't want in the result,
-		# and update what the no_use_set contains as well
-		if distance > 1:
-			no_use_set |= edits_by_1
-		return all_edits - no_use_set
+		codes = CombinationLockCracker.codes_at_distance(int(s_el), len(s_el), distance)
+		edits = {str(code).zfill(len(s_el)) for code in codes.tolist()}
+		if no_use_set is not None:
+			edits -= no_use_set
+		return edits
+
+	@staticmethod
+	def codes_at_distance(code: int, digit_count: int, distance: int) -> np.ndarray:
+		"""
+		return the sorted array of every code at exactly the given edit distance
+		from code, where editing a digit rotates it by one in either direction.
+
+		:param code: the code to edit
+		:param digit_count: the number of digits in the combination
+		:param distance: the desired distance from code
+		"""
+		powers = 10 ** np.arange(digit_count - 1, -1, -1)
+		digits = Models.digits(code, digit_count)
+		offsets = CombinationLockCracker.edit_offsets(digit_count, distance)
+		return np.sort((digits + offsets) % 10 @ powers)
+
+	@staticmethod
+	@lru_cache(maxsize=128)
+	def edit_offsets(digit_count: int, distance: int) -> np.ndarray:
+		"""
+		return the array of shape (k, digit_count) of every way to rotate the
+		digits of a code (each rotation in [0, 9], modulo 10) with a total edit
+		distance of exactly distance. Offsets don't depend on the code, so they
+		are cached, and each ring of edits is only built once per process.
+
+		:param digit_count: the number of digits in the combination
+		:param distance: the desired distance of the offsets
+		"""
+		# rotating a digit by c or by 10 - c costs min(c, 10 - c)
+		rotations = [[0], [1, 9], [2, 8], [3, 7], [4, 6], [5]]
+		# by_distance[t] holds the offsets of the digits processed so far
+		# whose rotations add up to t
+		by_distance = [np.zeros((1, 0), dtype=np.int64)] + \
+					  [np.zeros((0, 0), dtype=np.int64) for _ in range(distance)]
+		for i in range(digit_count):
+			shifted = []
+			for t in range(distance + 1):
+				parts = []
+				for c in range(min(t, 5) + 1):
+					previous = by_distance[t - c]
+					for rotation in rotations[c]:
+						column = np.full((len(previous), 1), rotation, dtype=np.int64)
+						parts.append(np.hstack([previous, column]))
+				shifted.append(np.vstack(parts))
+			by_distance = shifted
+		offsets = by_distance[distance]
+		offsets.setflags(write=False)
+		return offsets
@@ -1,4 +1,7 @@
 import random
+import sys
+import numpy as np
+from typing import Iterator, TextIO
 
 
 class LockCData:
@@ -64,11 +67,93 @@ class LockCData:
 		:param template: a string of the form: 'data/{category}_%d.txt'
 		:param number: the number on this category to load
 		"""
-		with open(template % number) as f:
-			bundle = [line.strip('\n') for line in f.readlines()]
-			code, digit_count = [int(el) for el in bundle[0].strip('CODE:').split(',')]
-			data = [int(observation) for observation in bundle[1:]]
-			return code, digit_count, data
+		code, digit_count, observations = LockCData.stream_data(template % number)
+		data = [int(observation) for observation in observations]
+		return code, digit_count, data
+
+	@staticmethod
+	def stream_data(source: str or TextIO = None) -> tuple:
+		"""
+		lazily read data from a file in the format described above. Only the
+		header is read right away. This returns the true code, the digit
+		count and a generator of the observation lines, which are read one
+		by one and left unparsed (see CombinationLockCracker.observe_stream).
+		The header is optional for data without a known code, in which case
+		the true code and the digit count are None.
+
+		:param source:
+			a path, an open file, or None (or '-') to read from stdin
+		"""
+		if source is None or source == '-':
+			f, close = sys.stdin, False
+		elif isinstance(source, str):
+			f, close = open(source), True
+		else:
+			f, close = source, False
+		code, digit_count, first = None, None, None
+		for line in f:
+			line = line.strip()
+			if not line:
+				continue
+			if line.startswith('CODE:'):
+				code, digit_count = [int(el) for el in line[len('CODE:'):].split(',')]
+			else:
+				first = line
+			break
+		return code, digit_count, LockCData._stream_observations(f, first, close)
+
+	@staticmethod
+	def _stream_observations(f: TextIO, first: str, close: bool) -> Iterator[str]:
+		"""
+		yield first (if any) then every non-empty line left in f, stripped.
+		f is closed at the end if close is True.
+		"""
+		try:
+			if first is not None:
+				yield first
+			for line in f:
+				line = line.strip()
+				if line:
+					yield line
+		finally:
+			if close:
+				f.close()
+
+	@staticmethod
+	def generate_histories(count: int, digit_count: int, length: int, simulated: bool = False,
+						   seed: int = None) -> tuple:
+		"""
+		generate synthetic lock histories in memory and return the true codes
+		as an array of shape (count,) with the observations as an array of
+		shape (count, length).
+		- random:
+			like generate_random_data, the observations are uniformly random
+			codes that never match the true code
+		- simulated:
+			mirrors the simulated category, each observation is the true code
+			shuffled by rotating each wheel by up to 5 steps either way, and
+			at least one wheel always moves
+		:param count: the number of histories
+		:param digit_count: the number of digits in the combos
+		:param length: the number of observations in each history
+		:param simulated: whether to simulate shuffling rather than random data
+		:param seed: the seed of the random generator
+		"""
+		rng = np.random.default_rng(seed)
+		sample_space_size = 10 ** digit_count
+		codes = rng.integers(0, sample_space_size, count)
+		if not simulated:
+			observations = (codes[:, None] + rng.integers(1, sample_space_size, (count, length))) % sample_space_size
+			return codes, observations
+		powers = 10 ** np.arange(digit_count - 1, -1, -1)
+		digits = codes[:, None] // powers % 10
+		steps = rng.integers(-5, 6, (count, length, digit_count))
+		# move one random wheel by one step whenever no wheel moved
+		history, observation = np.nonzero((steps == 0).all(axis=2))
+		wheel = rng.integers(0, digit_count, len(history))
+		steps[history, observation, wheel] = rng.choice([-1, 1], len(history))
+		observations = (digits[:, None, :] + steps) % 10 @ powers
+		return codes, observations
 
 	@staticmethod
 	def generate_random_data(number: int, true_combo: int, digit_count: int) -> None:
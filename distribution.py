@@ -1,5 +1,7 @@
+import numpy as np
 from typing import Callable
-from heap_pq import MaxHeapPriorityQueue
+from stats import Stats
+from topk import TopK, top_k_indices
 
 class Distribution(dict):
 	"""
@@ -7,6 +9,9 @@ class Distribution(dict):
 	distributions and manipulations.
 	"""
 	DELTA = 1e-8
+	# the time spent normalizing and copying distributions, of both
+	# Distribution and ArrayDistribution. set it to an enabled Stats to record it
+	stats: Stats = Stats(enabled=False)
 
 	def __init__(self, dist: dict = None) -> None:
 		"""
@@ -27,11 +32,12 @@ class Distribution(dict):
 		normalize the dictionary
 		if the dictionary is already normalize or empty, this does nothing
 		"""
-		total = sum(self.values())
-		# ensure we are within Distribution.DELTA threshold
-		if 1 - Distribution.DELTA < total < 1 + Distribution.DELTA:
-			return
-		for e in self: self[e] /= total
+		with Distribution.stats.stage('normalize'):
+			total = sum(self.values())
+			# ensure we are within Distribution.DELTA threshold
+			if 1 - Distribution.DELTA < total < 1 + Distribution.DELTA:
+				return
+			for e in self: self[e] /= total
 
 	def set(self, el: int or float, prob: float, normalize: bool=True) -> None:
 		"""
@@ -103,10 +109,10 @@ class Distribution(dict):
 		"""
 		return the @count most probable elements in the distribution
 		"""
-		pq = MaxHeapPriorityQueue(count, key=lambda el: self[el])
+		top = TopK(count, key=lambda el: self[el])
 		for el in self:
-			pq.insert(el)
-		return pq.sorted()
+			top.insert(el)
+		return top.sorted()
 
 	@staticmethod
 	def build_uniform_dist(keys: list):
@@ -119,8 +125,187 @@ class Distribution(dict):
 		"""
 		makes a copy of the distribution and returns it
 		"""
-		dic = {el: self[el] for el in self}
-		return Distribution(dic)
+		with Distribution.stats.stage('copy'):
+			dic = {el: self[el] for el in self}
+			return Distribution(dic)
+
+	def copy(self):
+		"""
+		see __copy__
+		"""
+		return self.__copy__()
+
+
+class ArrayDistribution:
+	"""
+	Same as Distribution, except that the elements and their probabilities
+	are kept in two NumPy arrays instead of a dict. Elements must be numbers.
+	They are validated once at construction, the moments are computed in
+	one pass over the arrays, and copies share the arrays until one of them
+	is modified (copy-on-write). Elements keep their order of insertion.
+	"""
+	DELTA = Distribution.DELTA
+
+	def __init__(self, dist: dict = None, keys: np.ndarray = None, probs: np.ndarray = None) -> None:
+		"""
+		initialize the distribution, either from a dictionary like Distribution
+		or from the arrays of elements and of their probabilities.
+
+		:param dist: dictionary mapping keys to numbers
+		:param keys: array of distinct numbers, used with probs
+		:param probs: array of the probability (or weight) of each key
+		"""
+		if dist is not None:
+			assert type(dist) == dict, 'argument must be a dictionary'
+			assert keys is None and probs is None, 'give either a dictionary or arrays, not both'
+			keys, probs = list(dist.keys()), list(dist.values())
+		keys = np.array([] if keys is None else keys)
+		probs = np.array([] if probs is None else probs, dtype=np.float64)
+		assert keys.ndim == 1 and keys.shape == probs.shape, 'keys and probs must be arrays of the same length'
+		assert len(keys) == 0 or keys.dtype.kind in 'iuf', 'distribution keys must be numbers'
+		assert len(np.unique(keys)) == len(keys), 'distribution keys must be distinct'
+		self._keys: np.ndarray = keys
+		self._probs: np.ndarray = probs
+		# the positions of the keys in sorted order, to look up keys by
+		# binary search. computed on demand and cleared when keys change
+		self._order: np.ndarray = None
+		self.normalize()
+
+	def _writeable(self) -> None:
+		"""
+		make sure the arrays are not shared with a copy before modifying them
+		"""
+		if not self._probs.flags.writeable:
+			with Distribution.stats.stage('copy'):
+				self._keys, self._probs = self._keys.copy(), self._probs.copy()
+
+	def _index(self, el: int or float) -> int or None:
+		"""
+		return the position of the element in the arrays, or None if missing
+		"""
+		if self._order is None:
+			self._order = np.argsort(self._keys, kind='stable')
+		position = np.searchsorted(self._keys, el, sorter=self._order)
+		if position < len(self._keys) and self._keys[self._order[position]] == el:
+			return int(self._order[position])
+		return None
+
+	def normalize(self) -> None:
+		"""
+		see Distribution.normalize
+		"""
+		with Distribution.stats.stage('normalize'):
+			total = self._probs.sum()
+			# ensure we are within ArrayDistribution.DELTA threshold
+			if len(self._probs) == 0 or 1 - ArrayDistribution.DELTA < total < 1 + ArrayDistribution.DELTA:
+				return
+			self._writeable()
+			self._probs /= total
+
+	def set(self, el: int or float, prob: float, normalize: bool = True) -> None:
+		"""
+		see Distribution.set
+		"""
+		assert type(el) == float or type(el) == int, 'keys must be a numbers'
+		assert type(prob) == float or type(prob) == int, 'prob must be a numbers'
+		self._writeable()
+		index = self._index(el)
+		if index is None:
+			self._keys = np.append(self._keys, el)
+			self._probs = np.append(self._probs, prob)
+			self._order = None
+		else:
+			self._probs[index] = prob
+		if normalize: self.normalize()
+
+	def prob(self, el: int or float) -> float:
+		"""
+		return the probability of the given element, 0 if it is missing
+		"""
+		index = self._index(el)
+		return 0.0 if index is None else float(self._probs[index])
+
+	def __getitem__(self, el: int or float) -> float:
+		return self.prob(el)
+
+	def __contains__(self, el: int or float) -> bool:
+		return self._index(el) is not None
+
+	def __iter__(self):
+		return iter(self._keys.tolist())
+
+	def __len__(self) -> int:
+		return len(self._keys)
+
+	def modes(self) -> list or None:
+		"""
+		see Distribution.modes
+		"""
+		if len(self._keys) == 0:
+			return None
+		return self._keys[self._probs == self._probs.max()].tolist()
+
+	def expectation(self) -> float:
+		"""
+		return the expectation of the distribution or 0 if empty
+		"""
+		return float(self._probs @ self._keys) if len(self._keys) > 0 else 0.0
+
+	def variance(self) -> float:
+		"""
+		return the variance of the distribution or 0 if empty. both moments
+		are summed in the same pass, around one of the keys rather than 0 to
+		limit the cancellation in E[x^2] - E[x]^2.
+		"""
+		if len(self._keys) == 0:
+			return 0.0
+		shifted = self._keys - self._keys[np.argmax(self._probs)]
+		weighted = self._probs * shifted
+		mean, second = weighted.sum(), weighted @ shifted
+		return float(max(second - mean ** 2, 0.0))
+
+	def projection(self, func: Callable):
+		"""
+		see Distribution.projection. func is called once on the array of every
+		element when it supports arrays, and on each element otherwise.
+		"""
+		try:
+			mapped = np.asarray(func(self._keys))
+			assert mapped.shape == self._keys.shape
+		except (TypeError, ValueError, AssertionError):
+			mapped = np.array([func(el) for el in self._keys.tolist()])
+		keys, index, inverse = np.unique(mapped, return_index=True, return_inverse=True)
+		probs = np.bincount(inverse.ravel(), weights=self._probs, minlength=len(keys))
+		# keep the elements in the order they first appear, like Distribution
+		order = np.argsort(index, kind='stable')
+		return ArrayDistribution(keys=keys[order], probs=probs[order])
+
+	def most_probable(self, count: int or float) -> list:
+		"""
+		see Distribution.most_probable: the @count most probable elements in
+		increasing order of probability, where the later element of a tie
+		comes first
+		"""
+		count = len(self._keys) if count == float('inf') else int(count)
+		return self._keys[top_k_indices(self._probs, count)[::-1]].tolist()
+
+	@staticmethod
+	def build_uniform_dist(keys: list):
+		"""
+		builds a uniform distribution from the keys given
+		"""
+		return ArrayDistribution(keys=keys, probs=np.ones(len(keys)))
+
+	def __copy__(self):
+		"""
+		makes a copy of the distribution and returns it. the copy shares the
+		arrays of this distribution until either of them is modified
+		"""
+		self._keys.setflags(write=False)
+		self._probs.setflags(write=False)
+		copy = ArrayDistribution.__new__(ArrayDistribution)
+		copy._keys, copy._probs, copy._order = self._keys, self._probs, self._order
+		return copy
 
 	def copy(self):
 		"""
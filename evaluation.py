@@ -0,0 +1,85 @@
+# evaluates how well each model of main.py ranks the true code of
+# synthetic lock histories, and how long it takes, in a process pool
+import argparse
+import json
+import os
+import time
+import numpy as np
+import main
+from concurrent.futures import ProcessPoolExecutor
+from batchcracker import BatchCombinationLockCracker
+from data import LockCData
+
+
+def evaluate_chunk(model: str, digit_count: int, codes: np.ndarray, observations: np.ndarray, ks: list) -> tuple:
+	"""
+	observe the histories one observation at a time with a batch cracker
+	and return the rank of the true code of each history after k
+	observations for each k in ks (an array of shape (len(ks), histories)),
+	with the number of seconds it took. this runs in the worker processes.
+	"""
+	start = time.perf_counter()
+	obs_model = main.FACTORIES[model](digit_count).obs_model
+	clc = BatchCombinationLockCracker(digit_count, obs_model, range(len(codes)))
+	ranks = np.zeros((len(ks), len(codes)))
+	for step in range(max(ks)):
+		clc.observe_batch([(lock, int(observations[lock, step])) for lock in range(len(codes))])
+		if step + 1 in ks:
+			ranks[ks.index(step + 1)] = [clc.rank(lock, int(codes[lock])) for lock in range(len(codes))]
+	return ranks, time.perf_counter() - start
+
+
+def evaluate(models: list, digit_count: int, codes: np.ndarray, observations: np.ndarray, ks: list,
+			 processes: int = None, chunk_size: int = 250) -> dict:
+	"""
+	evaluate every model over the histories, split into chunks of histories
+	evaluated in a pool of processes, and return a report for each model:
+	statistics of the rank of the true code after k observations for each k
+	in ks, and the time spent on the model in seconds (summed over chunks)
+	"""
+	chunks = [(start, min(start + chunk_size, len(codes))) for start in range(0, len(codes), chunk_size)]
+	with ProcessPoolExecutor(processes) as executor:
+		futures = {model: [executor.submit(evaluate_chunk, model, digit_count, codes[start:stop],
+										   observations[start:stop], ks) for start, stop in chunks]
+				   for model in models}
+		report = {}
+		for model in models:
+			results = [future.result() for future in futures[model]]
+			ranks = np.hstack([ranks for ranks, seconds in results])
+			report[model] = {
+				'seconds': sum(seconds for ranks, seconds in results),
+				'ranks': {k: {'mean': float(ranks[i].mean()), 'median': float(np.median(ranks[i])),
+							  'top_20': float(np.mean(ranks[i] <= 20)), 'top_100': float(np.mean(ranks[i] <= 100))}
+						  for i, k in enumerate(ks)},
+			}
+	return report
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='evaluate the models over synthetic lock histories')
+	parser.add_argument('--models', nargs='+', default=list(main.FACTORIES), choices=list(main.FACTORIES))
+	parser.add_argument('--histories', type=int, default=1000)
+	parser.add_argument('--digits', type=int, default=4)
+	parser.add_argument('--ks', type=int, nargs='+', default=[5, 10, 20])
+	parser.add_argument('--generator', choices=['random', 'simulated'], default='simulated')
+	parser.add_argument('--processes', type=int, default=os.cpu_count())
+	parser.add_argument('--chunk-size', type=int, default=250)
+	parser.add_argument('--seed', type=int, default=0)
+	parser.add_argument('--output', help='write the JSON report to this file instead of stdout')
+	args = parser.parse_args()
+
+	codes, observations = LockCData.generate_histories(args.histories, args.digits, max(args.ks),
+													   simulated=args.generator == 'simulated', seed=args.seed)
+	start = time.perf_counter()
+	report = {
+		'meta': {'histories': args.histories, 'digit_count': args.digits, 'generator': args.generator,
+				 'seed': args.seed, 'processes': args.processes},
+		'models': evaluate(args.models, args.digits, codes, observations, sorted(args.ks), args.processes,
+						   args.chunk_size),
+	}
+	report['meta']['seconds'] = time.perf_counter() - start
+	if args.output is None:
+		print(json.dumps(report, indent=2))
+	else:
+		with open(args.output, 'w') as f:
+			json.dump(report, f, indent=2)
@@ -0,0 +1,54 @@
+# fits the mapping of a distance model from lock histories whose true code
+# is known, and stores it for main.create_learned_clc
+import argparse
+import time
+import numpy as np
+import main
+from data import LockCData
+from models import Models
+
+
+def load_histories(paths: list) -> tuple:
+	"""
+	load the data files at paths and return the true code of every
+	observation with the observations, as two arrays of the same length,
+	and the digit count shared by every file
+	"""
+	actuals, observations, digit_counts = [], [], set()
+	for path in paths:
+		code, digit_count, stream = LockCData.stream_data(path)
+		assert code is not None, '%s has no CODE header, so its true code is unknown' % path
+		history = [int(obs) for obs in stream]
+		actuals.append(np.full(len(history), code, dtype=np.int64))
+		observations.append(np.array(history, dtype=np.int64))
+		digit_counts.add(digit_count)
+	assert len(digit_counts) == 1, 'every file must have the same digit count'
+	return np.concatenate(actuals), np.concatenate(observations), digit_counts.pop()
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='fit a distance model from lock histories')
+	parser.add_argument('--family', default='edit_distance', choices=list(main.DISTANCE_FUNCTIONS))
+	parser.add_argument('--data', nargs='*', help='data files with a CODE header, instead of synthetic histories')
+	parser.add_argument('--digits', type=int, default=4)
+	parser.add_argument('--histories', type=int, default=10000)
+	parser.add_argument('--length', type=int, default=20)
+	parser.add_argument('--generator', choices=['random', 'simulated'], default='simulated')
+	parser.add_argument('--seed', type=int, default=0)
+	parser.add_argument('--noise', type=float, default=0.01,
+						help='the probability of an observation uniform over every code, which smooths the model')
+	args = parser.parse_args()
+
+	if args.data:
+		actuals, observations, digit_count = load_histories(args.data)
+	else:
+		digit_count = args.digits
+		codes, histories = LockCData.generate_histories(args.histories, digit_count, args.length,
+														simulated=args.generator == 'simulated', seed=args.seed)
+		actuals, observations = np.repeat(codes, histories.shape[1]), histories.ravel()
+	distance_func = main.DISTANCE_FUNCTIONS[args.family]
+	start = time.perf_counter()
+	model_name = main.learned_model_name(args.family, digit_count)
+	Models.learn_distance_model(digit_count, distance_func, actuals, observations, model_name, args.noise)
+	print('fitted %d observations in %.3fs, stored as %s'
+		  % (len(observations), time.perf_counter() - start, Models.model_path(model_name)))
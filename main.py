@@ -1,4 +1,5 @@
 # see data.py for more details on the data
+from functools import partial
 from data import LockCData
 from combinationlockcracker import CombinationLockCracker
 from models import Models
@@ -14,31 +15,86 @@ def create_difference_distance_clc(digit_count: int) -> CombinationLockCracker:
 	return CombinationLockCracker(digit_count, Models.create_distance_model(digit_count))
 
 
-def create_edit_distance_clc(digit_count: int, encourage_distance: bool = False) -> CombinationLockCracker:
-	""" create an EDM combination lock cracker for digit count """
+def create_edit_distance_model(digit_count: int, encourage_distance: bool = False):
+	""" create the observation model of create_edit_distance_clc """
 	# the naming convention here describes how the edit distance
 	# function behaves. See Models.edit_distance for details
 	name = ('edit_cl1_ch1_%ddigits_' % digit_count) + ('encdist' if encourage_distance else 'noencdist')
-	d_model = Models.create_distance_model(digit_count, Models.edit_distance, model_name=name,
-										   enc_dist=encourage_distance, is_edit_distance=True)
-	return CombinationLockCracker(digit_count, d_model)
+	return Models.create_distance_model(digit_count, Models.edit_distance, model_name=name,
+										enc_dist=encourage_distance, is_edit_distance=True)
 
 
-def create_edit_distance_one_direction_clc(digit_count: int, encourage_distance: bool = False,
-										  up: bool = True) -> CombinationLockCracker:
+def create_edit_distance_clc(digit_count: int, encourage_distance: bool = False) -> CombinationLockCracker:
+	""" create an EDM combination lock cracker for digit count """
+	return CombinationLockCracker(digit_count, create_edit_distance_model(digit_count, encourage_distance))
+
+
+def create_edit_distance_one_direction_model(digit_count: int, encourage_distance: bool = False, up: bool = True):
+	""" create the observation model of create_edit_distance_one_direction_clc """
 	up_text = 'up' if up else 'down'
 	name = ('edit_%s_cl1_ch1_%ddigits_' % (up_text, digit_count)) + ('encdist' if encourage_distance else 'noencdist')
 	replace_cost_func = Models.replace_cost_by_rotations_up if up else Models.replace_cost_by_rotations_down
 	distance_func = lambda obs, act, d_count: Models.edit_distance(obs, act, d_count, replace_cost_func)
-	d_model = Models.create_distance_model(digit_count, distance_func, model_name=name,
-										   enc_dist=encourage_distance, is_edit_distance=True)
+	return Models.create_distance_model(digit_count, distance_func, model_name=name,
+										enc_dist=encourage_distance, is_edit_distance=True)
+
+
+def create_edit_distance_one_direction_clc(digit_count: int, encourage_distance: bool = False,
+										  up: bool = True) -> CombinationLockCracker:
+	return CombinationLockCracker(digit_count,
+								  create_edit_distance_one_direction_model(digit_count, encourage_distance, up))
+
+
+# the distance function of each family of learned models
+DISTANCE_FUNCTIONS = {
+	'digit_distance': Models.digit_distance,
+	'edit_distance': Models.edit_distance,
+	'edit_distance_up': partial(Models.edit_distance, replace_cost_func=Models.replace_cost_by_rotations_up),
+	'edit_distance_down': partial(Models.edit_distance, replace_cost_func=Models.replace_cost_by_rotations_down),
+}
+
+
+def learned_model_name(family: str, digit_count: int) -> str:
+	return 'learned_%s_%ddigits' % (family, digit_count)
+
+
+def create_learned_clc(digit_count: int, family: str = 'edit_distance') -> CombinationLockCracker:
+	""" create a combination lock cracker for digit count with the model fitted by learn.py """
+	d_model = Models.create_learned_model(digit_count, DISTANCE_FUNCTIONS[family], learned_model_name(family, digit_count))
 	return CombinationLockCracker(digit_count, d_model)
 
 
+def create_mixture_clc(digit_count: int, learn_weights: bool = True) -> CombinationLockCracker:
+	"""
+	create a combination lock cracker for digit count hedging across the models above. the
+	learned weights belong to the model, so a model that learns must not be shared across locks
+	"""
+	components = [Models.create_black_and_white_model(digit_count),
+				  Models.create_distance_model(digit_count),
+				  create_edit_distance_model(digit_count),
+				  create_edit_distance_one_direction_model(digit_count, up=True),
+				  create_edit_distance_one_direction_model(digit_count, up=False)]
+	name = ('mixture_%ddigits' if learn_weights else 'mixture_fixed_%ddigits') % digit_count
+	return CombinationLockCracker(digit_count, Models.create_mixture_model(digit_count, components, model_name=name,
+																			learn_weights=learn_weights))
+
+
+# every factory above by name, each taking the digit count. their models are
+# shared across locks (see service.py), so the mixture doesn't learn its weights
+FACTORIES = {
+	'black_and_white': create_black_and_white_clc,
+	'difference_distance': create_difference_distance_clc,
+	'edit_distance': create_edit_distance_clc,
+	'edit_distance_encouraged': partial(create_edit_distance_clc, encourage_distance=True),
+	'edit_distance_up': partial(create_edit_distance_one_direction_clc, up=True),
+	'edit_distance_down': partial(create_edit_distance_one_direction_clc, up=False),
+	'mixture': partial(create_mixture_clc, learn_weights=False),
+}
+
+
 def print_most_probable(clc: CombinationLockCracker, count: int, adjacency=False, max_distance: int = 2) -> None:
 	""" after having done all the observations, print the result"""
 	if adjacency:
-		# this takes quite a lot of time if max_distance is > 3
 		mps = clc.most_probable_adjacent(count, max_distance)
 	else:
 		mps = clc.most_probables(count)
@@ -69,9 +125,11 @@ if __name__ == '__main__':
 	# clc = create_edit_distance_clc(digit_count, encourage_distance=True)
 	# clc = create_edit_distance_one_direction_clc(digit_count, encourage_distance=False, up=True)
 	# clc = create_edit_distance_one_direction_clc(digit_count, encourage_distance=False, up=False)
+	# clc = create_mixture_clc(digit_count)
 
 	""" train the cracker with the observations given"""
-	clc.observe_list(observations)
+	observed, missed = clc.observe_list(observations)
+	print('observed %d out of %d' % (observed, observed + missed))
 
 	""" finally, print the most probable codes after having made the observations """
 	print_most_probable(clc, 100, adjacency=False)
@@ -1,12 +1,47 @@
-# use pickle to store models that are created because
-# it can take quite a while to create some of them
+# store models that are created because it can take quite a while
+# to create some of them. models used to be stored with pickle, so
+# we still read pickled models to convert them to the new format
+import glob
+import hashlib
+import json
+import os
 import pickle
+import struct
+from collections import OrderedDict
+from functools import lru_cache, partial
+import numpy as np
 import utils
-from distribution import Distribution
+from stats import Stats
 from typing import Callable
 
 
 class Models:
+	# stored models are a header followed by a contiguous table of
+	# float64 such that table[actual][distance] is the probability of
+	# observing a code at that distance from actual. see store_model
+	MODEL_DIRECTORY = 'models'
+	MODEL_MAGIC = b'CLCMODEL'
+	MODEL_VERSION = 1
+	# magic, version, digit_count, rows, columns
+	MODEL_HEADER = struct.Struct('<8sIIQQ')
+	# the tables of the stored models loaded so far in this process, by
+	# model name and digit count. see Models.get_model
+	_loaded_models: dict = {}
+	# the likelihood rows computed recently, by model, digit count,
+	# observation and log form, up to that many bytes of rows in total.
+	# see Models.cached_likelihood_row
+	LIKELIHOOD_CACHE_BYTES = 256 * 2 ** 20
+	_likelihood_cache: OrderedDict = OrderedDict()
+	_likelihood_cache_bytes: int = 0
+	# the largest table of mixed probabilities, see create_mixture_model
+	MIXTURE_TABLE_SIZE = 2 ** 16
+	# codes of up to that many digits have their digits read from a shared
+	# table, see Models.code_digits. larger codes compute them instead
+	CODE_DIGITS_TABLE_MAX = 6
+	# the time spent loading, building and storing models and the hits and
+	# misses of the likelihood cache. set it to an enabled Stats to record them
+	stats: Stats = Stats(enabled=False)
+
 	@staticmethod
 	def create_black_and_white_model(digit_count: int) -> Callable:
 		"""
@@ -27,11 +62,30 @@ class Models:
 		def prob_observation_given_actual(observation: int, actual: int) -> float:
 			return PROB if observation == actual else NO_PROB
 
+		def likelihood_row(observation: int, codes: np.ndarray = None) -> np.ndarray:
+			if codes is not None:
+				return np.where(codes == observation, PROB, NO_PROB)
+			row = np.full(10 ** digit_count, NO_PROB)
+			row[observation] = PROB
+			return row
+
+		def likelihood_total(observation: int) -> float:
+			return PROB + NO_PROB * (10 ** digit_count - 1)
+
+		prob_observation_given_actual.likelihood_row = likelihood_row
+		prob_observation_given_actual.likelihood_total = likelihood_total
+		# the same model as a factorized model (see create_factorized_model):
+		# each different digit costs 1 and only the distance 0 has PROB
+		prob_observation_given_actual.cost_table = 1 - np.eye(10, dtype=np.int64)
+		prob_observation_given_actual.mapping = {distance: PROB if distance == 0 else NO_PROB
+												 for distance in range(digit_count + 1)}
+		prob_observation_given_actual.model_name = 'black_and_white_%ddigits' % digit_count
 		return prob_observation_given_actual
 
 	@staticmethod
 	def create_distance_model(digit_count: int, distance_func: Callable = None, model_name: str = None,
-							  enc_dist: bool = False, is_edit_distance: bool = False) -> Callable:
+							  enc_dist: bool = False, is_edit_distance: bool = False,
+							  max_distance: int = None, build: bool = False) -> Callable:
 		"""
 		the distance model is a model such that the probability of observing
 		O given that A is the true value grows as O is more different than
@@ -45,14 +99,16 @@ class Models:
 			whenever they leave their bike.
 
 		Note:
-			We automatically store all distance models and then check whether
-			they are stored in the first place before creating a new one
+			Distance models that are not edit distances need a stored table
+			(see Models.build_distance_model). It is only loaded on the first
+			probability asked to the model, see Models.get_model.
 
 		:param distance_func:
 			a function that takes in observation, actual, and digit_count
 			and outputs how far observation is from actual (or vice versa)
 		:param model_name:
-			name of the model chosen when created or now
+			name of the model chosen when created or now. the returned model
+			exposes it as its model_name attribute, which identifies it
 		:param enc_dist:
 			this is a boolean that, if True, increases the probability of
 			further distances. The choice of how to increase the probability
@@ -61,21 +117,17 @@ class Models:
 			this is a boolean that, if True, means that we're using an edit
 			distance function. The reason this is important is because edit
 			distances are symmetrical, so we don't need a mapping for each
-			possible pairs of observation and actual.
+			possible pairs of observation and actual. The distance must be a
+			sum of per-digit costs (see Models.cost_table), which is checked
+			on a sample of codes: otherwise, this raises ValueError.
+		:param max_distance:
+			the largest distance distance_func can return, which is the size
+			of the stored table for models that are not edit distances. by
+			default, we assume each digit costs at most 9.
+		:param build:
+			if True, build and store the table when it isn't stored yet, which
+			can take hours. otherwise, a missing table raises FileNotFoundError
 		"""
-		# try to load the model, if it fails, create it then save it
-		try:
-			distance_model_map = Models.load_model(model_name)
-			assert distance_func is not None, 'we only store for non-null distance function'
-
-			def prob_observation_given_actual(obs: int, actual: int) -> float:
-				return distance_model_map[actual][distance_func(obs, actual, digit_count)]
-
-			return prob_observation_given_actual
-		except Exception as e:
-			print('* failed to load model *')
-			pass
-
 		# if no distance function given, use the digit_distance function
 		sample_space_size = 10 ** digit_count
 		if distance_func is None:
@@ -87,70 +139,680 @@ class Models:
 				mapping[i] = utils.nCr(digit_count, i) * multiplier / sample_space_size
 				multiplier *= 9
 
-			def prob_observation_given_actual(obs: int, actual: int) -> float:
-				return mapping[distance_func(obs, actual, digit_count)]
-
 			# no need to store in this case because it's efficient enough
-			return prob_observation_given_actual
+			cost_table = Models.cost_table(distance_func)
+			if model_name is None:
+				model_name = 'digit_distance_%ddigits' % digit_count
+			return Models.create_factorized_model(digit_count, distance_func, cost_table, mapping, model_name)
 
-		# if we're using an edit distance function, we can create the mapping
-		# more efficiently than every pairwise mapping of observation and actual
+		# if we're using an edit distance function, the distance is a sum of
+		# per-digit replace costs. so, we can compute the distance from one
+		# code to every other code with a 10x10 cost table instead of every
+		# pairwise mapping of observation and actual
 		if is_edit_distance:
+			cost_table = Models.cost_table(distance_func)
+			Models.check_per_digit_sum(digit_count, distance_func, cost_table)
+			# edit distances are the same from every actual, so use 0
+			distances, counts = np.unique(Models.distances_to_codes(cost_table, 0, digit_count),
+										  return_counts=True)
 			# create the mapping to use for every time a digit needs to be replaced
 			mapping: dict = {}
-			encouraging_distance:dict = {}
-			actual = 0
-			for observation in range(10 ** digit_count):
-				# the encouraging distance was made such that it doesn't increase
-				# too fast until it starts reaching really high values (around 16)
-				distance = distance_func(observation, actual, digit_count)
-				if not distance in encouraging_distance:
-					if enc_dist:
-						encouraging_distance[distance] = 0
-					else:
-						encouraging_distance[distance] = int(distance ** 1.7 + (2.1 ** distance / 1000))
-				mapping[distance] = mapping.get(distance, 0) + 1 + encouraging_distance[distance]
-
-			def prob_observation_given_actual(obs: int, actual: int) -> float:
-				return mapping[distance_func(obs, actual, digit_count)]
+			for distance, count in zip(distances.tolist(), counts.tolist()):
+				mapping[distance] = count * (1 + Models.encouraging_distance(distance, enc_dist))
+			# normalize the mapping, which is what storing the model used to do
+			total = sum(mapping.values())
+			mapping = {distance: mapping[distance] / total for distance in mapping}
 
 			# no need to store in this case because it's efficient enough
+			return Models.create_factorized_model(digit_count, distance_func, cost_table, mapping, model_name)
+
+		if not Models.is_model_stored(model_name):
+			if not build:
+				raise FileNotFoundError('no model stored as %s, build it with Models.build_distance_model '
+										'or pass build=True' % Models.model_path(model_name))
+			# get distance between all pairs for each potential actual, then
+			# create a distribution to use for each.
+			# WARNING: This is really inefficient and will take a very long time
+			# runs in O(n^2), and n is usually in the set {10000, 100000}. so, we
+			# amortize it by storing the model (see Models.store_model).
+			Models.build_distance_model(digit_count, distance_func, model_name, enc_dist, max_distance)
+		return Models.create_table_model(digit_count, distance_func, model_name=model_name)
+
+	@staticmethod
+	def check_per_digit_sum(digit_count: int, distance_func: Callable, cost_table: np.ndarray,
+							sample_size: int = 10 ** 5) -> None:
+		"""
+		raise ValueError unless distance_func is the sum over digits of
+		cost_table, which is what factorized models compute. it is compared
+		with distance_func from two observations to at most sample_size codes.
+		"""
+		sample_space_size = 10 ** digit_count
+		if sample_space_size <= sample_size:
+			codes = np.arange(sample_space_size)
+		else:
+			codes = np.random.default_rng(0).integers(0, sample_space_size, sample_size)
+		# an observation with every digit, not only zeros
+		for observation in [0, int(('1357924680' * digit_count)[:digit_count])]:
+			expected = Models.distances_to_codes(cost_table, observation, digit_count, codes)
+			if not np.array_equal(Models.apply_distance(distance_func, observation, codes, digit_count), expected):
+				raise ValueError('the distance function is not a sum of per-digit costs, so it needs '
+								 'is_edit_distance=False and a stored model')
+
+	@staticmethod
+	def apply_distance(distance_func: Callable, observations: int or np.ndarray, actuals: int or np.ndarray,
+					   digit_count: int) -> np.ndarray:
+		"""
+		return the array of the distances from observations to actuals, which
+		are codes or arrays of codes broadcast together. the distance functions
+		of Models take arrays, so they are called once. others are called once
+		per pair of codes.
+		"""
+		shape = np.broadcast_shapes(np.shape(observations), np.shape(actuals))
+		try:
+			distances = np.asarray(distance_func(observations, actuals, digit_count))
+		except (AssertionError, TypeError, ValueError):
+			distances = None
+		if distances is None or distances.shape != shape:
+			pairs = zip(*(np.broadcast_to(codes, shape).ravel().tolist() for codes in (observations, actuals)))
+			distances = np.array([distance_func(o, a, digit_count) for o, a in pairs]).reshape(shape)
+		return distances
+
+	@staticmethod
+	def build_distance_model(digit_count: int, distance_func: Callable, model_name: str, enc_dist: bool = False,
+							 max_distance: int = None, processes: int = None, shard_size: int = 1000,
+							 progress_every: int = None) -> None:
+		"""
+		build the table of a distance model that is not an edit distance and
+		store it as model_name. see create_distance_model for the parameters.
+
+		The rows are split into shards of consecutive actuals that a pool of
+		processes builds and writes straight into a partial model file. Every
+		finished shard is recorded next to that file, so an interrupted build
+		resumes from the shards that were completed. The record starts with
+		the parameters of the build (see Models.describe_build), and a build
+		with other parameters, such as another shard_size, starts over.
+
+		:param processes:
+			the number of processes to use, all the cpus by default. if the
+			distance function cannot be pickled (e.g. a lambda), we build the
+			shards in this process
+		:param shard_size: the number of actuals in each shard
+		:param progress_every: if given, print the progress every that many shards
+		"""
+		# only building needs processes, so don't import them on startup
+		from concurrent.futures import ProcessPoolExecutor, as_completed
+		assert model_name is not None, 'a model name is needed to store the model'
+		if max_distance is None:
+			max_distance = 9 * digit_count
+		rows, columns = 10 ** digit_count, max_distance + 1
+		# build in a partial file so that a failed build is never loaded
+		partial_path = Models.model_path(model_name, 'partial')
+		shards_path = Models.model_path(model_name, 'shards')
+		description = Models.describe_build(digit_count, distance_func, enc_dist, columns, shard_size)
+		shards = [(start, min(start + shard_size, rows)) for start in range(0, rows, shard_size)]
+		completed = set()
+		resumable = os.path.exists(partial_path) and os.path.exists(shards_path) \
+			and Models.read_model_header(partial_path) == (digit_count, rows, columns)
+		if resumable:
+			with open(shards_path) as f:
+				lines = f.read().splitlines()
+			resumable = len(lines) > 0 and lines[0] == description
+		if resumable:
+			# each line after the description is the [start, stop) of a shard
+			ranges = {tuple(int(bound) for bound in line.split()) for line in lines[1:] if line.strip()}
+			completed = {i for i, shard in enumerate(shards) if shard in ranges}
+		else:
+			Models.create_model_file(partial_path, digit_count, rows, columns)
+			with open(shards_path, 'w') as f:
+				f.write(description + '\n')
+		remaining = [i for i in range(len(shards)) if i not in completed]
+		if processes is None:
+			processes = os.cpu_count()
+		try:
+			pickle.dumps(distance_func)
+		except (pickle.PicklingError, AttributeError, TypeError):
+			processes = 1
+
+		def record(shard: int) -> None:
+			completed.add(shard)
+			with open(shards_path, 'a') as shards_file:
+				shards_file.write('%d %d\n' % shards[shard])
+			Models.stats.count('model_shards')
+			if progress_every is not None and (len(completed) % progress_every == 0 or len(completed) == len(shards)):
+				print('finished %d out of %d shards' % (len(completed), len(shards)))
+
+		arguments = lambda i: (partial_path, i, shards[i][0], shards[i][1], digit_count, distance_func, enc_dist)
+		with Models.stats.stage('model_build'):
+			if processes == 1:
+				for i in remaining:
+					record(Models.build_model_shard(*arguments(i)))
+			else:
+				with ProcessPoolExecutor(processes) as executor:
+					futures = [executor.submit(Models.build_model_shard, *arguments(i)) for i in remaining]
+					for future in as_completed(futures):
+						record(future.result())
+		os.replace(partial_path, Models.model_path(model_name))
+		os.remove(shards_path)
+
+	@staticmethod
+	def describe_build(digit_count: int, distance_func: Callable, enc_dist: bool, columns: int,
+					   shard_size: int) -> str:
+		"""
+		return the parameters of a build of Models.build_distance_model as one
+		line of JSON, which is the same for two builds with the same parameters
+		"""
+		return json.dumps({'digit_count': digit_count, 'distance_func': Models.describe_function(distance_func),
+						   'enc_dist': bool(enc_dist), 'columns': columns, 'shard_size': shard_size})
+
+	@staticmethod
+	def describe_function(func: object) -> str:
+		"""
+		return a description of a function that doesn't change from one
+		process to the other: its name and a hash of its code and of the
+		values it closes over, or the description of the function and the
+		arguments of a partial. other values are described by their repr.
+		"""
+		if isinstance(func, partial):
+			return 'partial(%s)' % ', '.join([Models.describe_function(func.func)] +
+											 [Models.describe_function(arg) for arg in func.args] +
+											 ['%s=%s' % (key, Models.describe_function(value))
+											  for key, value in sorted(func.keywords.items())])
+		code = getattr(func, '__code__', None)
+		if code is None:
+			return repr(func)
+		closure = [Models.describe_function(cell.cell_contents) for cell in func.__closure__ or ()]
+		digest = hashlib.sha256(code.co_code + repr((code.co_names, closure)).encode()).hexdigest()
+		return '%s.%s:%s' % (func.__module__, func.__qualname__, digest[:16])
+
+	@staticmethod
+	def build_model_shard(path: str, shard: int, start: int, stop: int, digit_count: int,
+						  distance_func: Callable, enc_dist: bool) -> int:
+		"""
+		build the rows of the actuals in [start, stop) and write them in the
+		model file at path, then return the shard number. this runs in the
+		worker processes of Models.build_distance_model
+		"""
+		table = Models.open_model_file(path, mode='r+')
+		for actual in range(start, stop):
+			table[actual] = Models.distance_row(actual, digit_count, distance_func, enc_dist, table.shape[1])
+		table.flush()
+		return shard
+
+	@staticmethod
+	def distance_row(actual: int, digit_count: int, distance_func: Callable, enc_dist: bool,
+					 columns: int) -> np.ndarray:
+		"""
+		return the row of the stored model for actual, that is the array such
+		that row[distance] is the probability of observing a code at that
+		distance from actual. see create_distance_model for the parameters.
+
+		:param columns: the size of the row, one more than the largest distance
+		"""
+		distances = Models.apply_distance(distance_func, np.arange(10 ** digit_count), actual, digit_count)
+		invalid = distances if distances.dtype.kind not in 'iu' else distances[(distances < 0) | (distances >= columns)]
+		if len(invalid) > 0:
+			raise ValueError('distance %s is not an integer in [0, %d], try a larger max_distance'
+							 % (str(invalid[0]), columns - 1))
+		row = np.bincount(distances.astype(np.int64), minlength=columns).astype(np.float64)
+		distances = np.flatnonzero(row)
+		row[distances] *= [1 + Models.encouraging_distance(int(d), enc_dist) for d in distances]
+		return row / row.sum()
+
+	@staticmethod
+	def encouraging_distance(distance: int, enc_dist: bool) -> int:
+		"""
+		return the weight added to each code at the given distance. the
+		encouraging distance was made such that it doesn't increase too fast
+		until it starts reaching really high values (around 16)
+		"""
+		if enc_dist:
+			return 0
+		return int(distance ** 1.7 + (2.1 ** distance / 1000))
+
+	@staticmethod
+	def create_table_model(digit_count: int, distance_func: Callable, table: np.ndarray = None,
+						   model_name: str = None) -> Callable:
+		"""
+		create a distance model from a stored table (see Models.store_model),
+		so that the probability of observing obs given actual is the array
+		lookup table[actual][distance_func(obs, actual)]. The table is returned
+		by the load_table attribute of the model.
+
+		:param table:
+			a table of shape (10^digit_count, max_distance + 1). if not given,
+			the table stored as model_name is loaded on first use (see
+			Models.get_model)
+		"""
+
+		def load_table() -> np.ndarray:
+			return table if table is not None else Models.get_model(model_name, digit_count)
+
+		def prob_observation_given_actual(obs: int, actual: int) -> float:
+			return float(load_table()[actual, distance_func(obs, actual, digit_count)])
+
+		def likelihood_row(obs: int, codes: np.ndarray = None) -> np.ndarray:
+			if codes is None:
+				codes = np.arange(10 ** digit_count)
+			# one call over every code, or one per code for distance functions that don't take arrays
+			distances = Models.apply_distance(distance_func, obs, codes, digit_count)
+			return load_table()[codes, distances.astype(np.int64)]
+
+		prob_observation_given_actual.load_table = load_table
+		prob_observation_given_actual.likelihood_row = likelihood_row
+		prob_observation_given_actual.model_name = model_name
+		return prob_observation_given_actual
+
+	@staticmethod
+	def create_factorized_model(digit_count: int, distance_func: Callable, cost_table: np.ndarray,
+								mapping: dict, model_name: str = None) -> Callable:
+		"""
+		create a distance model whose distance function is a sum of per-digit
+		costs. such a model is fully described by a 10x10 cost table (see
+		Models.cost_table) and the mapping from total distance to probability.
+		The returned model exposes both as the cost_table and mapping
+		attributes, and exposes a vectorized likelihood_row.
+
+		:param distance_func: the distance function the cost table comes from
+		:param cost_table: the per-digit cost table of distance_func
+		:param mapping: a dictionary mapping each total distance to its probability
+		"""
+
+		def prob_observation_given_actual(obs: int, actual: int) -> float:
+			return mapping[distance_func(obs, actual, digit_count)]
+
+		prob_observation_given_actual.cost_table = cost_table
+		prob_observation_given_actual.mapping = mapping
+		prob_observation_given_actual.model_name = model_name
+		# we can only index the mapping by distance for integer costs
+		if cost_table.dtype.kind != 'i':
 			return prob_observation_given_actual
 
-		# get distance between all pairs for each potential actual, then
-		# create a distribution to use for each.
-		# WARNING: This is really inefficient and will take a very long time
-		# runs in O(n^2), and n is usually in the set {10000, 100000}. so, we
-		# amortize it by storing the model using the pickle package.
-		prob_observation_given_actual_map: dict = {}
-		# map distances to their encouraging distance to avoid multiple
-		# computations.
-		encouraging_distance = {}
-		for actual in range(sample_space_size):
-			mapping = {}
-			for observation in range(sample_space_size):
-				distance = distance_func(observation, actual, digit_count)
-				# the encouraging distance was made such that it doesn't increase
-				# too fast until it starts reaching really high values (around 16)
-				if not distance in encouraging_distance:
-					if enc_dist:
-						encouraging_distance[distance] = 0
-					else:
-						encouraging_distance[distance] = int(distance ** 1.7 + (2.1 ** distance / 1000))
-				mapping[distance] = mapping.get(distance, 0) + 1 + encouraging_distance[distance]
-			# create a distribution to normalize the mapping
-			temp_dist = Distribution(mapping)
-			prob_observation_given_actual_map[actual] = {obs: temp_dist[obs] for obs in temp_dist}
-			print('finished conditional of %d' % actual)
+		mapping_array = np.zeros(int(cost_table.max()) * digit_count + 1)
+		for distance in mapping:
+			mapping_array[distance] = mapping[distance]
+
+		def likelihood_row(obs: int, codes: np.ndarray = None) -> np.ndarray:
+			return mapping_array[Models.distances_to_codes(cost_table, obs, digit_count, codes)]
+
+		def likelihood_total(obs: int) -> float:
+			# the number of codes at each distance is the convolution of the
+			# histograms of the cost table column of each observed digit
+			histogram = np.ones(1)
+			for i in range(digit_count):
+				column = cost_table[:, obs // 10 ** i % 10]
+				histogram = np.convolve(histogram, np.bincount(column, minlength=1))
+			return float(histogram @ mapping_array[:len(histogram)])
+
+		prob_observation_given_actual.likelihood_row = likelihood_row
+		prob_observation_given_actual.likelihood_total = likelihood_total
+		return prob_observation_given_actual
+
+	@staticmethod
+	def learn_distance_model(digit_count: int, distance_func: Callable, actuals: np.ndarray,
+							 observations: np.ndarray, model_name: str, noise: float = 0.01) -> Callable:
+		"""
+		fit the mapping of a distance model from observations made on locks
+		whose code is known (see Models.fit_distance_mapping), store it as
+		model_name and return the model (see Models.create_learned_model).
+		"""
+		mapping = Models.fit_distance_mapping(digit_count, distance_func, actuals, observations, noise)
+		Models.store_model(mapping[np.newaxis], model_name, digit_count)
+		return Models.create_learned_model(digit_count, distance_func, model_name)
+
+	@staticmethod
+	def create_learned_model(digit_count: int, distance_func: Callable, model_name: str) -> Callable:
+		"""
+		create the distance model whose mapping was fitted and stored as
+		model_name by Models.learn_distance_model. it is stored as a table of
+		a single row mapping each distance to its probability.
+		"""
+		stored_digit_count, rows, columns = Models.read_model_header(Models.model_path(model_name))
+		if stored_digit_count != digit_count or rows != 1:
+			raise ValueError('%s is not a learned model for %d digits' % (Models.model_path(model_name), digit_count))
+		mapping = dict(enumerate(Models.load_model(model_name)[0].tolist()))
+		return Models.create_factorized_model(digit_count, distance_func, Models.cost_table(distance_func),
+											  mapping, model_name)
+
+	@staticmethod
+	def fit_distance_mapping(digit_count: int, distance_func: Callable, actuals: np.ndarray,
+							 observations: np.ndarray, noise: float = 0.01) -> np.ndarray:
+		"""
+		fit the probability of observing each code given the true code, as a
+		function of the distance between the two, from pairs of observations
+		and true codes. with probability 1 - noise, the observation is at
+		distance d with probability pi[d] and uniform among the codes at that
+		distance, and with probability noise it is uniform over every code.
+		pi is the histogram of the distances of the pairs, which is its
+		maximum likelihood estimate. noise is not fitted: a uniform component
+		can be absorbed by pi, so the likelihood doesn't pin it down. it only
+		smooths the mapping so that distances never observed keep a chance.
+
+		The number of codes at each distance must be the same from every code,
+		which is the case of Models.digit_distance and Models.edit_distance.
+
+		:param actuals: the true code of each observation
+		:param observations: the observations, of the same length as actuals
+		:param noise: the probability of an observation uniform over every code
+		:return: the mapping as an array indexed by distance
+		"""
+		assert 0 <= noise <= 1, 'noise must be in [0, 1]'
+		cost_table = Models.cost_table(distance_func)
+		if cost_table.dtype.kind != 'i' or not (np.sort(cost_table, axis=1) == np.sort(cost_table[0])).all():
+			raise ValueError('the distance function must have integer costs that are the same from every digit')
+		# the number of codes at each distance from any code
+		at_distance = np.ones(1, dtype=np.int64)
+		for _ in range(digit_count):
+			at_distance = np.convolve(at_distance, np.bincount(cost_table[0]))
+		distances = Models.pair_distances(cost_table, np.asarray(observations).ravel(),
+										  np.asarray(actuals).ravel(), digit_count)
+		histogram = np.bincount(distances, minlength=len(at_distance))
+		if histogram.sum() == 0:
+			raise ValueError('there are no observations to fit')
+		possible = at_distance > 0
+		pi = histogram / histogram.sum()
+		mapping = (1 - noise) * np.divide(pi, at_distance, out=np.zeros_like(pi), where=possible) \
+			+ noise / 10 ** digit_count
+		return np.where(possible, mapping, 0.0)
+
+	@staticmethod
+	def pair_distances(cost_table: np.ndarray, observations: np.ndarray, actuals: np.ndarray,
+					   digit_count: int) -> np.ndarray:
+		"""
+		return the distance from each observation to the actual at the same
+		index, see Models.distances_to_codes
+		"""
+		distances = np.zeros(len(observations), dtype=cost_table.dtype)
+		for i in range(digit_count):
+			distances += cost_table[actuals // 10 ** i % 10, observations // 10 ** i % 10]
+		return distances
+
+	@staticmethod
+	def create_mixture_model(digit_count: int, components: list, weights: list = None, model_name: str = None,
+							 learn_weights: bool = True) -> Callable:
+		"""
+		the mixture model hedges across several models: the probability of
+		observing O given that A is the true value is the weighted average of
+		the probabilities given by each component model.
+
+		Every component must be a factorized model with integer costs (see
+		Models.create_factorized_model), which the black and white model and
+		every distance model but the stored ones are. That way, we evaluate
+		all the components in a single pass: component k's cost table is
+		multiplied by a stride and the tables are added into one, so the sum
+		of the stacked costs over the digits is the index of the tuple of the
+		distances of every component in a table of the mixed probabilities.
+		Since the mixed probability is a sum over components, the table is
+		split into groups of components whose tables have at most
+		Models.MIXTURE_TABLE_SIZE entries, so rebuilding them when the weights
+		change stays cheap. The likelihood row costs one outer sum (see
+		distances_to_codes) and one lookup per group, usually two, whatever
+		the number of components.
+
+		The models don't all sum to 1 over the observations (the black and
+		white model sums to about 10^digit_count), so each component is
+		normalized to do so before it is weighted. This needs the costs from
+		every digit to be the same up to order, like for every model here.
+
+		Note:
+			the weights are part of the model, so every cracker using the
+			model shares them. use one model per lock if they are learned.
+
+		:param components: the component models
+		:param weights: the weight of each component, uniform by default
+		:param learn_weights:
+			if True, the model exposes update_weights, which the cracker calls
+			on every observation with its posterior before the update. Each
+			weight is then multiplied by the probability of the observation
+			under its component given that posterior, and renormalized
+		"""
+		assert len(components) > 0, 'a mixture needs at least one component'
+		for component in components:
+			cost_table = getattr(component, 'cost_table', None)
+			if cost_table is None or cost_table.dtype.kind != 'i' \
+					or not (np.sort(cost_table, axis=1) == np.sort(cost_table[0])).all():
+				raise ValueError('%s is not a factorized model with integer costs that are the same from every '
+								 'digit' % getattr(component, 'model_name', component))
+		weights = np.ones(len(components)) if weights is None else np.array(weights, dtype=np.float64)
+		assert len(weights) == len(components) and (weights >= 0).all() and weights.sum() > 0, \
+			'there must be a non-negative weight for each component'
+		sample_space_size = 10 ** digit_count
+		# the distances of component k take sizes[k] values and count strides[k]
+		sizes = [int(component.cost_table.max()) * digit_count + 1 for component in components]
+		strides = np.cumprod([1] + sizes[:-1]).tolist()
+		stacked = sum(component.cost_table * stride for component, stride in zip(components, strides))
+		mappings = []
+		for component, size in zip(components, sizes):
+			mapping = np.zeros(size)
+			for distance in component.mapping:
+				mapping[distance] = component.mapping[distance]
+			# the number of observations at each distance from any code
+			at_distance = np.ones(1)
+			for _ in range(digit_count):
+				at_distance = np.convolve(at_distance, np.bincount(component.cost_table[0]))
+			mappings.append(mapping / (at_distance @ mapping[:len(at_distance)]))
+		# consecutive components are grouped while the table of their tuples
+		# of distances stays small. group g is (its components, the stride of
+		# its first component, the size of its table)
+		groups = []
+		for k, size in enumerate(sizes):
+			if len(groups) == 0 or groups[-1][2] * size > Models.MIXTURE_TABLE_SIZE:
+				groups.append(([], strides[k], 1))
+			members, base, span = groups[-1]
+			groups[-1] = (members + [k], base, span * size)
+		# the tables depend on the weights, so they are rebuilt when they
+		# change. the indexes of the last full row are kept for update_weights
+		state = {'weights': weights / weights.sum(), 'tables': None, 'last': (None, None)}
+
+		def mixed_tables() -> list:
+			if state['tables'] is None:
+				state['tables'] = []
+				for members, base, span in groups:
+					# component k varies along the axis that has stride strides[k]
+					table = np.zeros([sizes[k] for k in reversed(members)])
+					for axis, k in enumerate(reversed(members)):
+						shape = [1] * len(members)
+						shape[axis] = sizes[k]
+						table += state['weights'][k] * mappings[k].reshape(shape)
+					state['tables'].append(table.ravel())
+			return state['tables']
+
+		def local_indexes(index: np.ndarray, group: int) -> np.ndarray:
+			# the index of each tuple of distances in the table of the group
+			members, base, span = groups[group]
+			if base > 1:
+				index = index // base
+			return index % span if group < len(groups) - 1 else index
+
+		def indexes(obs: int, codes: np.ndarray = None) -> np.ndarray:
+			if codes is not None:
+				return Models.distances_to_codes(stacked, obs, digit_count, codes)
+			if state['last'][0] != obs:
+				state['last'] = (obs, Models.distances_to_codes(stacked, obs, digit_count))
+			return state['last'][1]
 
 		def prob_observation_given_actual(obs: int, actual: int) -> float:
-			distance = distance_func(obs, actual, digit_count)
-			return prob_observation_given_actual_map[actual][distance]
+			index = int(Models.pair_distances(stacked, np.array([obs]), np.array([actual]), digit_count)[0])
+			return float(sum(table[local_indexes(index, group)] for group, table in enumerate(mixed_tables())))
+
+		def likelihood_row(obs: int, codes: np.ndarray = None) -> np.ndarray:
+			index = indexes(obs, codes)
+			row = None
+			for group, table in enumerate(mixed_tables()):
+				values = table[local_indexes(index, group)]
+				row = values if row is None else row + values
+			return row
+
+		def component_totals(obs: int) -> np.ndarray:
+			# the sum of the normalized likelihood row of each component, from
+			# the number of codes at each distance (see create_factorized_model)
+			totals = []
+			for component, mapping in zip(components, mappings):
+				histogram = np.ones(1)
+				for i in range(digit_count):
+					histogram = np.convolve(histogram, np.bincount(component.cost_table[:, obs // 10 ** i % 10]))
+				totals.append(histogram @ mapping[:len(histogram)])
+			return np.array(totals)
 
-		# store the model
-		Models.store_model(prob_observation_given_actual_map, model_name)
+		def likelihood_total(obs: int) -> float:
+			return float(state['weights'] @ component_totals(obs))
+
+		def update_weights(obs: int, posterior: np.ndarray = None, codes: np.ndarray = None) -> None:
+			if posterior is None:
+				evidence = component_totals(obs) / sample_space_size
+			else:
+				index = indexes(obs, codes)
+				evidence = np.zeros(len(components))
+				for group, (members, base, span) in enumerate(groups):
+					# the posterior mass of each tuple of distances of the group
+					mass = np.bincount(local_indexes(index, group), weights=posterior, minlength=span)
+					present = np.flatnonzero(mass)
+					for k in members:
+						evidence[k] = mass[present] @ mappings[k][present // (strides[k] // base) % sizes[k]]
+			weights = state['weights'] * evidence
+			if weights.sum() > 0:
+				state['weights'], state['tables'] = weights / weights.sum(), None
+
+		prob_observation_given_actual.components = components
+		prob_observation_given_actual.weights = lambda: state['weights'].copy()
+		prob_observation_given_actual.likelihood_row = likelihood_row
+		prob_observation_given_actual.likelihood_total = likelihood_total
+		prob_observation_given_actual.model_name = model_name
+		if learn_weights:
+			prob_observation_given_actual.update_weights = update_weights
+			# rows change with the weights, see cached_likelihood_row
+			prob_observation_given_actual.cacheable = False
 		return prob_observation_given_actual
 
+	@staticmethod
+	def likelihood_row(observation_model: Callable, observation: int, digit_count: int,
+					   codes: np.ndarray = None) -> np.ndarray:
+		"""
+		return the array of the probabilities of observing observation given
+		each code is the true code. Models that know how to compute that row
+		in a vectorized way expose it as a likelihood_row attribute, otherwise
+		we call the observation model for every code.
+
+		:param observation_model: see CombinationLockCracker.__init__
+		:param observation: an integer representing a single observation
+		:param digit_count: the number of digits in the combination
+		:param codes: if given, only compute the row for these codes, in order
+		"""
+		likelihood_row = getattr(observation_model, 'likelihood_row', None)
+		if likelihood_row is not None:
+			return likelihood_row(observation) if codes is None else likelihood_row(observation, codes)
+		if codes is None:
+			codes = range(10 ** digit_count)
+		return np.fromiter((observation_model(observation, el) for el in codes), dtype=np.float64, count=len(codes))
+
+	@staticmethod
+	def cached_likelihood_row(observation_model: Callable, observation: int, digit_count: int,
+							  log: bool = False) -> np.ndarray:
+		"""
+		same as Models.likelihood_row, or its log if log is True, except that
+		the rows are kept in a least recently used cache of at most
+		Models.LIKELIHOOD_CACHE_BYTES bytes. So, an observation that was made
+		before doesn't compute its row again. The returned row is shared, so
+		it is read-only. Models whose rows change over time, which have a
+		cacheable attribute that is False, are never cached.
+		"""
+		if not getattr(observation_model, 'cacheable', True):
+			row = Models.likelihood_row(observation_model, observation, digit_count)
+			if log:
+				with np.errstate(divide='ignore'):
+					row = np.log(row)
+			return row
+		key = (observation_model, digit_count, observation, log)
+		cache = Models._likelihood_cache
+		if key in cache:
+			Models.stats.count('likelihood_cache_hits')
+			cache.move_to_end(key)
+			return cache[key]
+		Models.stats.count('likelihood_cache_misses')
+		row = cache.get((observation_model, digit_count, observation, False))
+		if row is None:
+			row = Models.likelihood_row(observation_model, observation, digit_count)
+		if log:
+			# a likelihood of 0 rules the code out, so log(0) = -inf is expected
+			with np.errstate(divide='ignore'):
+				row = np.log(row)
+		row.setflags(write=False)
+		if row.nbytes <= Models.LIKELIHOOD_CACHE_BYTES:
+			cache[key] = row
+			Models._likelihood_cache_bytes += row.nbytes
+			while Models._likelihood_cache_bytes > Models.LIKELIHOOD_CACHE_BYTES:
+				Models._likelihood_cache_bytes -= cache.popitem(last=False)[1].nbytes
+		return row
+
+	@staticmethod
+	def clear_likelihood_cache() -> None:
+		"""
+		empty the cache of Models.cached_likelihood_row
+		"""
+		Models._likelihood_cache.clear()
+		Models._likelihood_cache_bytes = 0
+
+	@staticmethod
+	def likelihood_total(observation_model: Callable, observation: int, digit_count: int) -> float:
+		"""
+		return the sum over every code of the probability of observing
+		observation given that code. Models that can compute it without the
+		whole likelihood row expose it as a likelihood_total attribute.
+
+		:param observation_model: see CombinationLockCracker.__init__
+		:param observation: an integer representing a single observation
+		:param digit_count: the number of digits in the combination
+		"""
+		likelihood_total = getattr(observation_model, 'likelihood_total', None)
+		if likelihood_total is not None:
+			return likelihood_total(observation)
+		return float(Models.likelihood_row(observation_model, observation, digit_count).sum())
+
+	@staticmethod
+	def cost_table(distance_func: Callable) -> np.ndarray:
+		"""
+		return the 10x10 table such that cost_table[a][o] is the cost of having
+		digit o in the observation where the actual code has digit a. this is
+		only meaningful if distance_func is a sum of per-digit costs, such as
+		Models.digit_distance and Models.edit_distance, in which case a one
+		digit code is enough to read every cost.
+
+		:param distance_func:
+			a function that takes in observation, actual, and digit_count
+			and outputs how far observation is from actual (or vice versa)
+		"""
+		table = np.array([[distance_func(o, a, 1) for o in range(10)] for a in range(10)])
+		if np.array_equal(table, np.round(table)):
+			return table.astype(np.int64)
+		return table.astype(np.float64)
+
+	@staticmethod
+	def distances_to_codes(cost_table: np.ndarray, observation: int, digit_count: int,
+						   codes: np.ndarray = None) -> np.ndarray:
+		"""
+		return the distance from observation to every code at once, indexed by
+		code. Since the distance is a sum over digits, this is an outer sum of
+		one column of the cost table per digit of the observation, which avoids
+		any string manipulation.
+
+		:param cost_table: the per-digit cost table, see Models.cost_table
+		:param observation: the observed code
+		:param codes: if given, only the distances to these codes, in order
+		"""
+		# use the smallest type that holds the largest distance to save memory
+		dtype = np.min_scalar_type(int(cost_table.max()) * digit_count) \
+			if cost_table.dtype.kind == 'i' else cost_table.dtype
+		if codes is not None:
+			distances = np.zeros(len(codes), dtype=dtype)
+			for i in range(digit_count - 1, -1, -1):
+				column = cost_table[:, observation // 10 ** i % 10].astype(dtype)
+				distances += column[codes // 10 ** i % 10]
+			return distances
+		distances = np.zeros(1, dtype=dtype)
+		for i in range(digit_count - 1, -1, -1):
+			digit = observation // 10 ** i % 10
+			distances = np.add.outer(distances, cost_table[:, digit].astype(dtype)).ravel()
+		return distances
+
 	@staticmethod
 	def digit_distance(observation: int, actual: int, digit_count: int) -> int or float:
 		"""
@@ -162,13 +824,12 @@ class Models:
 		using this as a distance function on the distance model is still naive because
 		it doesn't account for the fact that although 5555 and 6666 differ by 4 digits,
 		6666 is more similar to 5555 than 1234 is.
+
+		observation and actual can also be arrays of codes, in which case this
+		returns the array of their distances.
 		"""
-		obs_s = Models.extend_integer(observation, digit_count)
-		act_s = Models.extend_integer(actual, digit_count)
-		distance = 0
-		for i in range(len(obs_s)):
-			distance += 1 if obs_s[i] != act_s[i] else 0
-		return distance
+		distances = (Models.digits(observation, digit_count) != Models.digits(actual, digit_count)).sum(axis=-1)
+		return distances.item() if distances.ndim == 0 else distances
 
 	@staticmethod
 	def edit_distance(observation: int, actual: int, digit_count: int,
@@ -183,21 +844,61 @@ class Models:
 			(observation, actual). I.e., replace cost of 1111 to 2222 should be
 			the same as replacing cost of 2222 to 3333.
 
+		observation and actual can also be arrays of codes, in which case this
+		returns the array of their distances.
+
 		:param replace_cost_func:
-			this is a method that takes two argument, (character_origin (co), character_new (cn)),
-			and gives the cost of changing co to cn.
+			this is a method that takes two argument, (digit_origin (co), digit_new (cn)),
+			and gives the cost of changing co to cn. It is only called once per
+			pair of digits, see Models.replace_cost_table.
 		"""
-		obs_s = Models.extend_integer(observation, digit_count)
-		act_s = Models.extend_integer(actual, digit_count)
 		if replace_cost_func is None:
 			# the cost of changing co to cn is equal to the shortest length
 			# in a rotating wheel that co is from cn if arranging digits
 			# 0 through 9 in a wheel
-			replace_cost_func = lambda co, cn: Models.replace_cost_by_rotations(co, cn)
-		distance = 0
-		for i in range(len(obs_s)):
-			distance += replace_cost_func(act_s[i], obs_s[i])
-		return distance
+			replace_cost_func = Models.replace_cost_by_rotations
+		table = Models.replace_cost_table(replace_cost_func)
+		distances = table[Models.digits(actual, digit_count), Models.digits(observation, digit_count)].sum(axis=-1)
+		return distances.item() if distances.ndim == 0 else distances
+
+	@staticmethod
+	@lru_cache(maxsize=128)
+	def replace_cost_table(replace_cost_func: Callable) -> np.ndarray:
+		"""
+		return the read-only 10x10 table such that table[co][cn] is the cost
+		of changing digit co to digit cn, see Models.edit_distance. it is built
+		once per replace cost function.
+		"""
+		table = np.array([[replace_cost_func(co, cn) for cn in range(10)] for co in range(10)])
+		table = table.astype(np.int64 if np.array_equal(table, np.round(table)) else np.float64)
+		table.setflags(write=False)
+		return table
+
+	@staticmethod
+	@lru_cache(maxsize=None)
+	def code_digits(digit_count: int) -> np.ndarray:
+		"""
+		return the read-only uint8 table of shape (10^digit_count, digit_count)
+		such that table[code] holds the digits of code from left to right,
+		including the leading zeros. it is built once per digit count and
+		shared by every model, see Models.digits.
+		"""
+		table = np.indices((10,) * digit_count, dtype=np.uint8).reshape(digit_count, -1).T.copy()
+		table.setflags(write=False)
+		return table
+
+	@staticmethod
+	def digits(codes: int or np.ndarray, digit_count: int) -> np.ndarray:
+		"""
+		return the digits of a code, or of an array of codes, from left to
+		right as uint8, in an array with one more axis of size digit_count.
+		they come from Models.code_digits unless codes have more than
+		Models.CODE_DIGITS_TABLE_MAX digits, whose table would be too large.
+		"""
+		if digit_count <= Models.CODE_DIGITS_TABLE_MAX:
+			return Models.code_digits(digit_count)[codes]
+		powers = 10 ** np.arange(digit_count - 1, -1, -1)
+		return (np.asarray(codes)[..., np.newaxis] // powers % 10).astype(np.uint8)
 
 	@staticmethod
 	def extend_integer(number: int, digit_count: int) -> str:
@@ -205,10 +906,7 @@ class Models:
 		Extend the number to become as long as digit_count but as a string
 		"""
 		assert type(number) == int, 'expecting a number, instead received -> ' + str(number)
-		string_representation = str(number)
-		while len(string_representation) < digit_count:
-			string_representation = '0' + string_representation
-		return string_representation
+		return str(number).zfill(digit_count)
 
 	@staticmethod
 	def replace_cost_by_rotations(co: str or int, cn: str or int, cost_lower: int = 1, cost_higher: int = 1) -> int:
@@ -232,16 +930,24 @@ class Models:
 		if type(cn) == str:
 			assert len(cn) == 1, 'must be a single digit'
 			cn = int(cn)
-		if co == cn:
-			return 0
-		# here, we're going down from co to cn, add 1 for
-		# the cost of reaching 9 or 0 from 0 or 9 respectively
-		lower = (co - cn if co > cn else co + 9 - cn + 1) * cost_lower
-		# this is as if we're going down from cn to co,
-		# add 1 for the same reason as above
-		higher = (cn - co if cn > co else cn + 9 - co + 1) * cost_higher
+		return int(Models.rotation_cost_table(cost_lower, cost_higher)[co, cn])
+
+	@staticmethod
+	@lru_cache(maxsize=128)
+	def rotation_cost_table(cost_lower: int = 1, cost_higher: int = 1) -> np.ndarray:
+		"""
+		return the read-only 10x10 table such that table[co][cn] is
+		Models.replace_cost_by_rotations(co, cn, cost_lower, cost_higher)
+		"""
+		co, cn = np.indices((10, 10))
+		# here, we're going down from co to cn, wrapping from 0 to 9
+		lower = (co - cn) % 10 * cost_lower
+		# this is as if we're going down from cn to co
+		higher = (cn - co) % 10 * cost_higher
 		# assuming people are efficient
-		return min(lower, higher)
+		table = np.minimum(lower, higher)
+		table.setflags(write=False)
+		return table
 
 	@staticmethod
 	def replace_cost_by_rotations_up(co: str or int, cn: str or int):
@@ -262,20 +968,117 @@ class Models:
 		return Models.replace_cost_by_rotations(co, cn, 1, 11)
 
 	@staticmethod
-	def store_model(model: dict, name: str) -> None:
+	def model_path(name: str, extension: str = 'model') -> str:
+		"""
+		return the path of the model stored by name
+		"""
+		return os.path.join(Models.MODEL_DIRECTORY, '%s.%s' % (name, extension))
+
+	@staticmethod
+	def create_model_file(path: str, digit_count: int, rows: int, columns: int) -> np.ndarray:
+		"""
+		create the file of a model with its header and return its table as a
+		writable memory-mapped array filled with zeros. see store_model.
+		"""
+		with open(path, 'wb') as f:
+			f.write(Models.MODEL_HEADER.pack(Models.MODEL_MAGIC, Models.MODEL_VERSION, digit_count, rows, columns))
+			f.truncate(Models.MODEL_HEADER.size + rows * columns * 8)
+		return np.memmap(path, dtype='<f8', mode='r+', offset=Models.MODEL_HEADER.size, shape=(rows, columns))
+
+	@staticmethod
+	def store_model(model: np.ndarray, name: str, digit_count: int) -> None:
+		"""
+		store the model by name. A stored model is a header made of the magic
+		bytes, the format version, the digit count and the shape of the table,
+		followed by the table as contiguous little-endian float64.
+		"""
+		with Models.stats.stage('model_store'):
+			table = Models.create_model_file(Models.model_path(name), digit_count, *model.shape)
+			table[:] = model
+			table.flush()
+
+	@staticmethod
+	def load_model(name: str) -> np.ndarray:
+		"""
+		load the model by name as a read-only memory-mapped table, so loading
+		doesn't copy anything and processes share the same memory. If the
+		model was stored with pickle, it is converted first.
+		"""
+		path = Models.model_path(name)
+		if not os.path.exists(path) and os.path.exists(Models.model_path(name, 'pickle')):
+			Models.migrate_model(name)
+		if not os.path.exists(path):
+			raise FileNotFoundError('no model stored as %s' % path)
+		return Models.open_model_file(path)
+
+	@staticmethod
+	def is_model_stored(name: str) -> bool:
+		"""
+		return whether a model is stored by name, with pickle or not
+		"""
+		return os.path.exists(Models.model_path(name)) or os.path.exists(Models.model_path(name, 'pickle'))
+
+	@staticmethod
+	def get_model(name: str, digit_count: int) -> np.ndarray:
+		"""
+		return the table of the model stored by name for digit_count digits.
+		The table is loaded (see Models.load_model) the first time it is asked
+		for, and every later call in this process returns the same table.
+		"""
+		key = (name, digit_count)
+		if key not in Models._loaded_models:
+			with Models.stats.stage('model_load'):
+				table = Models.load_model(name)
+			if len(table) != 10 ** digit_count:
+				raise ValueError('%s is not a model for %d digits' % (Models.model_path(name), digit_count))
+			Models._loaded_models[key] = table
+		return Models._loaded_models[key]
+
+	@staticmethod
+	def read_model_header(path: str) -> tuple:
+		"""
+		return the digit count, rows and columns from the header of the model
+		file at path, after having ensured that it is in the current format.
+		"""
+		with open(path, 'rb') as f:
+			header = f.read(Models.MODEL_HEADER.size)
+		magic, version, digit_count, rows, columns = Models.MODEL_HEADER.unpack(header)
+		if magic != Models.MODEL_MAGIC or version != Models.MODEL_VERSION:
+			raise ValueError('%s is not a version %d model' % (path, Models.MODEL_VERSION))
+		return digit_count, rows, columns
+
+	@staticmethod
+	def open_model_file(path: str, mode: str = 'r') -> np.ndarray:
+		"""
+		return the table of the model file at path as a memory-mapped array
+		"""
+		digit_count, rows, columns = Models.read_model_header(path)
+		return np.memmap(path, dtype='<f8', mode=mode, offset=Models.MODEL_HEADER.size, shape=(rows, columns))
+
+	@staticmethod
+	def migrate_model(name: str) -> None:
 		"""
-		store the model by name
+		convert a model stored with pickle, which maps each actual to a
+		dictionary mapping distances to probabilities, to the current format.
 		"""
-		pickle.dump(model, open('models/%s.pickle' % name, 'wb'))
-		print('* distance model built and stored as %s *' % ('models/%s.txt' % name))
+		with open(Models.model_path(name, 'pickle'), 'rb') as f:
+			model_map = pickle.load(f)
+		rows = len(model_map)
+		columns = max(max(model_map[actual]) for actual in model_map) + 1
+		digit_count = len(str(rows - 1))
+		table = np.zeros((rows, columns))
+		for actual in model_map:
+			for distance in model_map[actual]:
+				table[actual, distance] = model_map[actual][distance]
+		Models.store_model(table, name, digit_count)
 
 	@staticmethod
-	def load_model(name: str) -> dict:
+	def migrate_models() -> None:
 		"""
-		load the model by name
+		convert every model stored with pickle in the model directory
 		"""
-		print('model loading as %s' % ('models/%s.pickle' % name))
-		return pickle.load(open('models/%s.pickle' % name, 'rb'))
+		for path in sorted(glob.glob(Models.model_path('*', 'pickle'))):
+			Models.migrate_model(os.path.splitext(os.path.basename(path))[0])
 
 
 # below, I was just doing some simple tests for edit distance
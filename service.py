@@ -0,0 +1,281 @@
+# serves crack queries for many locks to other local tools, over a unix
+# socket or TCP. every request and response is one line of JSON:
+#   {"op": "observe", "lock": "bike", "observations": ["1234", "5678"]}
+#   {"ok": true, "result": {"observed": 2, "missed": 0}}
+# see CrackerService.handle for the operations and CrackerClient for a client
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import quote
+import main
+from combinationlockcracker import CombinationLockCracker
+
+# the observation model of each (model, digit count) used by this process
+_observation_models: dict = {}
+
+
+def observation_model(model: str, digit_count: int):
+	"""
+	return the observation model of the main.FACTORIES factory named model,
+	created once per process
+	"""
+	key = (model, digit_count)
+	if key not in _observation_models:
+		_observation_models[key] = main.FACTORIES[model](digit_count).obs_model
+	return _observation_models[key]
+
+
+def observe_session(model: str, digit_count: int, options: dict, state: dict, observations: list) -> tuple:
+	"""
+	observe the observations in a session with the options given, starting
+	from the state given (see CombinationLockCracker.state), and return its
+	new state and the number of observations observed and missed. this runs
+	in the worker processes.
+	"""
+	clc = CombinationLockCracker(digit_count, observation_model(model, digit_count), state=state, **options)
+	observed, missed = clc.observe_list(observations)
+	return clc.state(), observed, missed
+
+
+class CrackerService:
+	"""
+	An asyncio service that keeps one CombinationLockCracker session per lock
+	id, all with the same model. At most @capacity sessions are kept in
+	memory: the least recently used one is written to a snapshot (see
+	CombinationLockCracker.snapshot) and restored when its lock is used
+	again. Observations are observed in a pool of processes, one update at
+	a time per lock, while queries are answered in the event loop.
+	"""
+
+	def __init__(self, model: str, digit_count: int, snapshot_directory: str, capacity: int = 16,
+				 processes: int = None) -> None:
+		"""
+		initialize the service
+
+		:param model: the name of the model in main.FACTORIES
+		:param digit_count: the number of digits of the locks
+		:param snapshot_directory: where to write the snapshots of the evicted sessions
+		:param capacity: the number of sessions to keep in memory
+		:param processes:
+			the number of processes to observe in, all the cpus by default. if
+			0, observations are observed in the event loop
+		"""
+		assert model in main.FACTORIES, 'unknown model %s' % model
+		assert capacity >= 1, 'capacity must be at least 1'
+		self._model: str = model
+		self._digit_count: int = digit_count
+		self._snapshot_directory: str = snapshot_directory
+		self._capacity: int = capacity
+		self._obs_model = observation_model(model, digit_count)
+		self._sessions: OrderedDict = OrderedDict()
+		# one lock per lock id, so that updates of the same lock don't overlap
+		self._updating: dict = {}
+		# forked workers would inherit the sockets of the clients connected
+		# so far, and keep them open after the clients close them
+		self._executor = None if processes == 0 else \
+			ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('spawn'))
+		os.makedirs(snapshot_directory, exist_ok=True)
+
+	def _snapshot_path(self, lock_id: str) -> str:
+		return os.path.join(self._snapshot_directory, '%s.npz' % quote(lock_id, safe=''))
+
+	def _session(self, lock_id: str) -> CombinationLockCracker:
+		"""
+		return the session of the lock, restoring it from its snapshot or
+		creating it if it isn't in memory, and evict sessions over capacity
+		"""
+		if lock_id in self._sessions:
+			self._sessions.move_to_end(lock_id)
+			return self._sessions[lock_id]
+		path = self._snapshot_path(lock_id)
+		if os.path.exists(path):
+			clc = CombinationLockCracker.restore(path, self._obs_model)
+		else:
+			clc = CombinationLockCracker(self._digit_count, self._obs_model)
+		self._sessions[lock_id] = clc
+		# sessions being updated are skipped, their update would be lost
+		for evicted in list(self._sessions):
+			if len(self._sessions) <= self._capacity:
+				break
+			if evicted != lock_id and not self._updating_lock(evicted).locked():
+				self._sessions.pop(evicted).snapshot(self._snapshot_path(evicted))
+		return clc
+
+	def _updating_lock(self, lock_id: str) -> asyncio.Lock:
+		if lock_id not in self._updating:
+			self._updating[lock_id] = asyncio.Lock()
+		return self._updating[lock_id]
+
+	async def observe(self, lock_id: str, observations: list) -> dict:
+		"""
+		observe the observations of the lock and return how many were
+		observed and missed
+		"""
+		async with self._updating_lock(lock_id):
+			clc = self._session(lock_id)
+			if self._executor is None:
+				observed, missed = clc.observe_list(observations)
+			else:
+				arguments = (self._model, self._digit_count, clc.options(), clc.state(), list(observations))
+				state, observed, missed = \
+					await asyncio.get_running_loop().run_in_executor(self._executor, observe_session, *arguments)
+				clc.load_state(state)
+				# the worker's session records nothing
+				clc.stats.count('observed', observed)
+				clc.stats.count('missed', missed)
+		return {'observed': observed, 'missed': missed}
+
+	async def handle(self, request: dict) -> object:
+		"""
+		answer one request and return its result. every request has an op and
+		a lock, and the other parameters of its op:
+			observe: observations, a list of observations
+			top_k: count, see CombinationLockCracker.most_probables
+			prob: code, see CombinationLockCracker.prob
+			marginals: see CombinationLockCracker.digit_marginals
+			adjacent: count and max_distance, see CombinationLockCracker.most_probable_adjacent
+			plan: count, see CombinationLockCracker.trial_plan
+		codes are returned as lists of [code, probability] pairs.
+		"""
+		op, lock_id = request['op'], str(request['lock'])
+		if op == 'observe':
+			return await self.observe(lock_id, request['observations'])
+		clc = self._session(lock_id)
+		if op == 'top_k':
+			return list(clc.most_probables(int(request['count'])).items())
+		if op == 'prob':
+			return clc.prob(int(request['code']))
+		if op == 'marginals':
+			return clc.digit_marginals().tolist()
+		if op == 'adjacent':
+			return list(clc.most_probable_adjacent(int(request['count']), int(request.get('max_distance', 2))).items())
+		if op == 'plan':
+			return clc.trial_plan(int(request['count']))
+		raise ValueError('unknown op %s' % op)
+
+	async def _serve_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+		"""
+		answer the requests of one connection, one line at a time
+		"""
+		try:
+			while True:
+				line = await reader.readline()
+				if not line:
+					break
+				try:
+					response = {'ok': True, 'result': await self.handle(json.loads(line))}
+				# any failure, such as a broken process pool, is the client's
+				# answer, and the connection stays open for the next requests
+				except Exception as e:
+					response = {'ok': False, 'error': '%s: %s' % (type(e).__name__, str(e))}
+				writer.write((json.dumps(response) + '\n').encode())
+				await writer.drain()
+		finally:
+			writer.close()
+
+	async def start(self, path: str = None, host: str = '127.0.0.1', port: int = 0) -> asyncio.AbstractServer:
+		"""
+		start serving on the unix socket at path if given, otherwise on TCP
+		"""
+		if path is not None:
+			return await asyncio.start_unix_server(self._serve_client, path)
+		return await asyncio.start_server(self._serve_client, host, port)
+
+	def close(self) -> None:
+		"""
+		write every session in memory to its snapshot and stop the processes
+		"""
+		while self._sessions:
+			lock_id, clc = self._sessions.popitem(last=False)
+			clc.snapshot(self._snapshot_path(lock_id))
+		if self._executor is not None:
+			self._executor.shutdown()
+
+
+class CrackerClient:
+	"""
+	A client of CrackerService. Each method sends one request and returns its
+	result, or raises RuntimeError with the error of the service, or
+	ConnectionError if the service closed the connection.
+	"""
+
+	def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+		self._reader, self._writer = reader, writer
+
+	@staticmethod
+	async def connect(path: str = None, host: str = '127.0.0.1', port: int = None):
+		"""
+		connect to the service on the unix socket at path if given, otherwise on TCP
+		"""
+		if path is not None:
+			return CrackerClient(*await asyncio.open_unix_connection(path))
+		return CrackerClient(*await asyncio.open_connection(host, port))
+
+	async def request(self, op: str, lock_id: str, **params) -> object:
+		self._writer.write((json.dumps(dict(params, op=op, lock=lock_id)) + '\n').encode())
+		await self._writer.drain()
+		line = await self._reader.readline()
+		if not line:
+			raise ConnectionError('the service closed the connection')
+		response = json.loads(line)
+		if not response['ok']:
+			raise RuntimeError(response['error'])
+		return response['result']
+
+	async def observe(self, lock_id: str, observations: list) -> dict:
+		return await self.request('observe', lock_id, observations=observations)
+
+	async def top_k(self, lock_id: str, count: int) -> list:
+		return await self.request('top_k', lock_id, count=count)
+
+	async def prob(self, lock_id: str, code: int) -> float:
+		return await self.request('prob', lock_id, code=code)
+
+	async def marginals(self, lock_id: str) -> list:
+		return await self.request('marginals', lock_id)
+
+	async def adjacent(self, lock_id: str, count: int, max_distance: int = 2) -> list:
+		return await self.request('adjacent', lock_id, count=count, max_distance=max_distance)
+
+	async def plan(self, lock_id: str, count: int) -> list:
+		return await self.request('plan', lock_id, count=count)
+
+	async def close(self) -> None:
+		self._writer.close()
+		await self._writer.wait_closed()
+
+
+async def serve(service: CrackerService, path: str = None, host: str = '127.0.0.1', port: int = 0) -> None:
+	"""
+	serve until cancelled, then snapshot every session
+	"""
+	server = await service.start(path, host, port)
+	print('serving on %s' % ', '.join(str(socket.getsockname()) for socket in server.sockets))
+	try:
+		async with server:
+			await server.serve_forever()
+	finally:
+		service.close()
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='serve crack queries for many locks')
+	parser.add_argument('--model', default='edit_distance', choices=list(main.FACTORIES))
+	parser.add_argument('--digits', type=int, default=4)
+	parser.add_argument('--socket', help='serve on this unix socket instead of TCP')
+	parser.add_argument('--host', default='127.0.0.1')
+	parser.add_argument('--port', type=int, default=8765)
+	parser.add_argument('--snapshots', default='snapshots', help='the directory of the evicted sessions')
+	parser.add_argument('--capacity', type=int, default=16)
+	parser.add_argument('--processes', type=int, default=os.cpu_count())
+	args = parser.parse_args()
+
+	try:
+		asyncio.run(serve(CrackerService(args.model, args.digits, args.snapshots, args.capacity, args.processes),
+						  args.socket, args.host, args.port))
+	except KeyboardInterrupt:
+		pass
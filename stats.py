@@ -0,0 +1,78 @@
+import contextlib
+import json
+import time
+
+
+class Stats:
+	"""
+	Opt-in instrumentation: counters and per-stage timings, such as the
+	time spent computing likelihood rows or normalizing the posterior.
+	A disabled Stats records nothing and its stages are a shared
+	nullcontext, so instrumented code costs next to nothing by default.
+
+		stats = Stats()
+		with stats.stage('likelihood'):
+			...
+		stats.count('observed')
+		print(stats.to_json())
+	"""
+	_DISABLED = contextlib.nullcontext()
+
+	def __init__(self, enabled: bool = True) -> None:
+		"""
+		:param enabled: whether to record anything
+		"""
+		self.enabled: bool = enabled
+		self.counters: dict = {}
+		# every stage maps to [calls, seconds]
+		self.stages: dict = {}
+
+	def stage(self, name: str):
+		"""
+		return a context manager that times its block as one call of the stage
+		"""
+		if not self.enabled:
+			return Stats._DISABLED
+		return _Stage(self, name)
+
+	def count(self, name: str, number: int = 1) -> None:
+		"""
+		add number to the counter
+		"""
+		if self.enabled:
+			self.counters[name] = self.counters.get(name, 0) + number
+
+	def reset(self) -> None:
+		"""
+		forget everything recorded so far
+		"""
+		self.counters, self.stages = {}, {}
+
+	def to_dict(self) -> dict:
+		"""
+		return the counters and, for each stage, its number of calls and the
+		total time spent in it in seconds
+		"""
+		return {'counters': dict(self.counters),
+				'stages': {name: {'calls': calls, 'seconds': seconds}
+						   for name, (calls, seconds) in self.stages.items()}}
+
+	def to_json(self, indent: int = None) -> str:
+		return json.dumps(self.to_dict(), indent=indent)
+
+
+class _Stage:
+	"""
+	times one call of a stage of Stats
+	"""
+
+	def __init__(self, stats: Stats, name: str) -> None:
+		self.stats, self.name = stats, name
+
+	def __enter__(self) -> None:
+		self.start = time.perf_counter()
+
+	def __exit__(self, *exception) -> None:
+		seconds = time.perf_counter() - self.start
+		calls, total = self.stats.stages.get(self.name, (0, 0.0))
+		self.stats.stages[self.name] = (calls + 1, total + seconds)
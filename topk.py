@@ -0,0 +1,70 @@
+import heapq
+import numpy as np
+from typing import Hashable, Callable
+
+
+class TopK:
+	"""
+	Bounded alternative to heap_pq.MaxHeapPriorityQueue. It only keeps the
+	@count largest elements inserted so far (using the comparison determined
+	with @key) in a min-heap of size @count, so inserting n elements runs in
+	O(n log(@count)) and uses O(@count) memory. Ties are broken by order of
+	insertion: an element inserted earlier beats an equal one inserted later.
+	"""
+
+	def __init__(self, count: int or float, key: Callable = lambda i: i, elements: list = None) -> None:
+		"""
+		initialize the top-k structure.
+		:param count: the needed number of elements to return when calling .sorted()
+		:param elements: a list of elements to already include in this structure
+		:param key: a function mapping elements to numerical values to use for comparison
+		"""
+		self.count, self.key = count, key
+		# entries are (key, -insertion index, element) so that the root of the
+		# min-heap is the smallest element, and the latest inserted on ties
+		self.A = []
+		self._inserted = 0
+		if elements is not None:
+			assert type(elements) == list, 'elements must be a list'
+			for el in elements: self.insert(el)
+
+	def insert(self, el: Hashable) -> None:
+		"""
+		insert an element, dropping the smallest element if we have too many
+		"""
+		entry = (self.key(el), -self._inserted, el)
+		self._inserted += 1
+		if len(self.A) < self.count:
+			heapq.heappush(self.A, entry)
+		elif self.count > 0 and entry[:2] > self.A[0][:2]:
+			heapq.heapreplace(self.A, entry)
+
+	def sorted(self) -> list:
+		"""
+		return the @self.count largest elements in increasing order, like
+		MaxHeapPriorityQueue.sorted. this removes all data from the structure.
+		"""
+		entries = sorted(self.A, key=lambda entry: entry[:2])
+		self.A = []
+		return [entry[2] for entry in entries]
+
+
+def top_k_indices(values: np.ndarray, count: int) -> np.ndarray:
+	"""
+	return the indices of the @count largest values of the array, from the
+	largest to the smallest value. Ties are broken by increasing index. This
+	runs in O(n + count log(count)) with a partition instead of a full sort.
+	"""
+	count = max(min(count, len(values)), 0)
+	if count == 0:
+		return np.zeros(0, dtype=np.intp)
+	if count < len(values):
+		# the count-th largest value splits the array: we keep everything
+		# above it and the first indices that are equal to it
+		threshold = np.partition(values, len(values) - count)[len(values) - count]
+		larger = np.flatnonzero(values > threshold)
+		equal = np.flatnonzero(values == threshold)[:count - len(larger)]
+		candidates = np.concatenate([larger, equal])
+	else:
+		candidates = np.arange(len(values))
+	return candidates[np.lexsort((candidates, -values[candidates]))]
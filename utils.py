@@ -1,4 +1,5 @@
 import math
+import numpy as np
 
 
 def nCr(n: int, r: int) -> float:
@@ -6,3 +7,14 @@ def nCr(n: int, r: int) -> float:
 	n choose r, see here: https://en.wikipedia.org/wiki/Binomial_coefficient
 	"""
 	return math.factorial(n) / math.factorial(r) / math.factorial(n - r)
+
+
+def logsumexp(values: np.ndarray) -> float:
+	"""
+	return log(sum(exp(values))) without underflowing or overflowing, see
+	here: https://en.wikipedia.org/wiki/LogSumExp
+	"""
+	maximum = np.max(values)
+	if not np.isfinite(maximum):
+		return float(maximum)
+	return float(maximum + np.log(np.sum(np.exp(values - maximum))))